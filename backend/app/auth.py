@@ -1,12 +1,21 @@
 import os
+import time
+import logging
+import secrets
+import sqlite3
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from .database import get_db
+from .cache import TTLCache
+from .database import SessionLocal
+from .metrics import cache_collector, register_collector
 from .models import User
+from .state import publish, state_backend, subscribe
+
+logger = logging.getLogger(__name__)
 
 # 从环境变量读取JWT密钥，必须设置
 SECRET_KEY = os.getenv("JWT_SECRET_KEY")
@@ -15,9 +24,51 @@ if not SECRET_KEY:
 
 ALGORITHM = "HS256"
 EXPIRE_HOURS = 24 * 7  # 7天
+# 下载凭证：放在下载链接的查询参数中，由浏览器直接下载（不经过 JS 内存），有效期很短且只能使用一次
+DOWNLOAD_TOKEN_SECONDS = 60
+DOWNLOAD_SCOPE = "download"
+# 已使用的下载凭证（jti -> 过期时间），存放在共享状态中，多 worker 时同样只能用一次
+DOWNLOAD_USED_KEY = "download_tokens_used"
 
 security = HTTPBearer()
 
+# 认证缓存：token -> (user_id, 过期时间)，user_id -> 用户快照
+# 管理员修改用户时通过 invalidate_user 立即失效
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+_token_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+_user_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+# 失效计数：任一用户失效时加一。查询前后计数不同则不写缓存，避免与失效并发的查询把旧数据写回；
+# 用一个全局计数而不是按用户记录版本，内存占用不随失效过的用户数增长（失效很少发生，偶尔少缓存一次无妨）
+_invalidations = 0
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """认证用的用户只读快照（与数据库会话无关，可安全缓存）"""
+    id: int
+    phone: str
+    tier: str
+    tier_expire_at: Optional[datetime]
+    binded_agents: str
+    is_admin: bool
+    is_active: bool
+    created_at: datetime
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        return cls(
+            id=user.id,
+            phone=user.phone,
+            tier=user.tier,
+            tier_expire_at=user.tier_expire_at,
+            binded_agents=user.binded_agents or "[]",
+            is_admin=bool(user.is_admin),
+            is_active=bool(user.is_active),
+            created_at=user.created_at,
+        )
+
 
 def create_token(user_id: int) -> str:
     """Create JWT token for user."""
@@ -29,22 +80,119 @@ def create_token(user_id: int) -> str:
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 
+def create_download_token(user_id: int) -> str:
+    """签发短期下载凭证"""
+    expire = datetime.utcnow() + timedelta(seconds=DOWNLOAD_TOKEN_SECONDS)
+    payload = {
+        "sub": str(user_id),
+        "scope": DOWNLOAD_SCOPE,
+        "jti": secrets.token_urlsafe(16),
+        "exp": expire
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def _consume_download_jti(jti: str, expire_ts: float) -> bool:
+    """登记下载凭证已使用；已经用过返回 False。顺带清理已过期的记录，登记表只保留有效期内的凭证"""
+    now = time.time()
+
+    def update(used):
+        used = {key: exp for key, exp in (used or {}).items() if exp > now}
+        if jti in used:
+            return used, False
+        used[jti] = expire_ts
+        return used, True
+
+    try:
+        return state_backend.update(DOWNLOAD_USED_KEY, update)
+    except sqlite3.Error as e:
+        logger.error("Failed to record download token use: %s", e)
+        return False
+
+
+def verify_download_token(token: str) -> Optional[int]:
+    """校验并消耗下载凭证，返回 user_id；过期或已使用过返回 None（凭证会出现在访问日志中，不能重放）"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    if payload.get("scope") != DOWNLOAD_SCOPE or payload.get("sub") is None or not payload.get("jti"):
+        return None
+    if not _consume_download_jti(payload["jti"], float(payload["exp"])):
+        return None
+    return int(payload["sub"])
+
+
 def verify_token(token: str) -> Optional[int]:
     """Verify JWT token and return user_id."""
+    cached = _token_cache.get(token)
+    if cached is not None:
+        user_id, expire_ts = cached
+        if time.time() < expire_ts:
+            return user_id
+        _token_cache.pop(token)
+        return None
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = payload.get("sub")
-        if user_id is None:
+        # 下载凭证只能用于下载链接，不能作为登录凭证
+        if user_id is None or payload.get("scope") is not None:
             return None
-        return int(user_id)
+        user_id = int(user_id)
     except JWTError:
         return None
 
+    expire_ts = payload.get("exp")
+    if expire_ts is not None:
+        _token_cache.set(token, (user_id, float(expire_ts)))
+    return user_id
+
+
+def get_user_snapshot(user_id: int) -> Optional[UserSnapshot]:
+    """获取用户快照，优先读缓存"""
+    snapshot = _user_cache.get(user_id)
+    if snapshot is None:
+        version = _invalidations
+        db = SessionLocal()
+        try:
+            user = db.query(User).filter(User.id == user_id).first()
+        finally:
+            db.close()
+        if user is None:
+            return None
+        snapshot = UserSnapshot.from_user(user)
+        if _invalidations == version:
+            _user_cache.set(user_id, snapshot)
+    return snapshot
+
+
+def _invalidate_user_local(user_id: int):
+    global _invalidations
+    _invalidations += 1
+    _user_cache.pop(user_id)
+
+
+def invalidate_user(user_id: int):
+    """用户信息变更（禁用、等级调整等）后调用，使缓存的快照立即失效（包括其他 worker）"""
+    _invalidate_user_local(user_id)
+    publish("user", user_id)
+
+
+subscribe("user", _invalidate_user_local)
+register_collector(cache_collector("luna_auth_cache", lambda: {"token": _token_cache, "user": _user_cache}))
+
+
+def auth_cache_stats() -> dict:
+    return {
+        "tokens": _token_cache.stats(),
+        "users": _user_cache.stats(),
+    }
+
 
 def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> UserSnapshot:
     """Get current user from JWT token."""
     token = credentials.credentials
     user_id = verify_token(token)
@@ -56,7 +204,7 @@ def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    user = db.query(User).filter(User.id == user_id).first()
+    user = get_user_snapshot(user_id)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -73,9 +221,8 @@ def get_current_user(
 
 
 def get_current_user_optional(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False)),
-    db: Session = Depends(get_db)
-) -> Optional[User]:
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))
+) -> Optional[UserSnapshot]:
     """Get current user if token provided, otherwise return None."""
     if credentials is None:
         return None
@@ -86,11 +233,11 @@ def get_current_user_optional(
     if user_id is None:
         return None
 
-    user = db.query(User).filter(User.id == user_id).first()
+    user = get_user_snapshot(user_id)
     return user if user and user.is_active else None
 
 
-def require_admin(current_user: User = Depends(get_current_user)) -> User:
+def require_admin(current_user: UserSnapshot = Depends(get_current_user)) -> UserSnapshot:
     """Require admin user."""
     if not current_user.is_admin:
         raise HTTPException(
@@ -98,3 +245,32 @@ def require_admin(current_user: User = Depends(get_current_user)) -> User:
             detail="需要管理员权限",
         )
     return current_user
+
+
+def require_admin_download(
+    token: Optional[str] = Query(None, description="短期下载凭证（POST /api/admin/download-token 获取）"),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))
+) -> UserSnapshot:
+    """下载接口的管理员认证：接受 Authorization 头，或查询参数中的短期下载凭证"""
+    if token is None:
+        if credentials is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="无效的认证凭证",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        return require_admin(get_current_user(credentials))
+
+    user_id = verify_download_token(token)
+    if user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="下载链接已失效，请重新导出",
+        )
+    user = get_user_snapshot(user_id)
+    if user is None or not user.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="用户已被禁用",
+        )
+    return require_admin(user)
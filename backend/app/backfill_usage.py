@@ -0,0 +1,24 @@
+"""
+从 chat_messages 重建 user_agent_usage 汇总表
+
+    cd backend && python -m app.backfill_usage
+"""
+from pathlib import Path
+from dotenv import load_dotenv
+
+# 与 main.py 一致，先加载 .env 再导入数据库配置
+load_dotenv(Path(__file__).parent.parent / ".env")
+
+from .database import SessionLocal, init_db
+from .services.usage import rebuild_usage
+
+
+def main():
+    init_db()
+    with SessionLocal() as db:
+        count = rebuild_usage(db)
+    print(f"Rebuilt user_agent_usage: {count} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import time
+import asyncio
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from .models import Agent
+from .state import STATE_POLL_INTERVAL, publish, state_backend, subscribe
+
+
+@dataclass(frozen=True)
+class AgentEntry:
+    """智能体配置的只读快照"""
+    id: int
+    name: str
+    icon: str
+    description: Optional[str]
+    category: str
+    api_endpoint: str
+    api_token: str
+    project_id: str
+    rate_limit: Optional[float]
+    rate_burst: Optional[int]
+    max_in_flight: Optional[int]
+    queue_depth: Optional[int]
+    tier_required: str
+    status: str
+    sort_order: int
+    quick_prompts: str
+    answer_cache: bool
+    stateless: bool
+    created_at: datetime
+
+    @classmethod
+    def from_agent(cls, agent: Agent) -> "AgentEntry":
+        return cls(
+            id=agent.id,
+            name=agent.name,
+            icon=agent.icon,
+            description=agent.description,
+            category=agent.category,
+            api_endpoint=agent.api_endpoint,
+            api_token=agent.api_token,
+            project_id=agent.project_id,
+            rate_limit=agent.rate_limit,
+            rate_burst=agent.rate_burst,
+            max_in_flight=agent.max_in_flight,
+            queue_depth=agent.queue_depth,
+            tier_required=agent.tier_required,
+            status=agent.status,
+            sort_order=agent.sort_order,
+            quick_prompts=agent.quick_prompts or "[]",
+            answer_cache=bool(agent.answer_cache),
+            stateless=bool(agent.stateless),
+            created_at=agent.created_at,
+        )
+
+
+@dataclass(frozen=True)
+class Catalog:
+    """智能体目录快照：构建后不再修改，变更时整体替换"""
+    version: int
+    agents: Tuple[AgentEntry, ...]  # 按 sort_order, id 排序
+    by_id: Mapping[int, AgentEntry]
+
+    def get(self, agent_id: int) -> Optional[AgentEntry]:
+        return self.by_id.get(agent_id)
+
+
+_catalog: Optional[Catalog] = None
+_version = 0
+_lock = threading.Lock()
+_last_miss_rebuild = 0.0
+
+
+def rebuild_catalog(db: Optional[Session] = None) -> Catalog:
+    """从数据库重建目录并原子替换（启动时及管理员增删改智能体后调用）"""
+    global _catalog, _version
+    # 查询也在锁内进行，保证后替换的快照一定读到更新的数据
+    with _lock:
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            agents = db.query(Agent).order_by(Agent.sort_order, Agent.id).all()
+            entries = tuple(AgentEntry.from_agent(agent) for agent in agents)
+        finally:
+            if own_session:
+                db.close()
+
+        _version += 1
+        _catalog = Catalog(
+            version=_version,
+            agents=entries,
+            by_id=MappingProxyType({entry.id: entry for entry in entries}),
+        )
+        return _catalog
+
+
+def refresh_catalog(db: Session) -> Catalog:
+    """管理员增删改智能体后调用：重建本进程目录，并通知其他 worker 重建"""
+    catalog = rebuild_catalog(db)
+    publish("catalog")
+    return catalog
+
+
+# 其他 worker 修改了智能体，在线程中重建本进程的目录
+subscribe("catalog", lambda _: asyncio.to_thread(rebuild_catalog))
+
+
+async def get_catalog(agent_id: Optional[int] = None) -> Catalog:
+    """
+    获取当前目录快照，尚未构建时先构建
+
+    多 worker 部署时，其他 worker 新增的智能体要等下一次事件轮询才会出现；
+    传入 agent_id 且目录中没有它时，从数据库重建一次（限频）再返回。
+    重建是同步查询，放到线程中执行，不阻塞事件循环上的其他请求和 SSE 流。
+    """
+    global _last_miss_rebuild
+    catalog = _catalog
+    if catalog is None:
+        catalog = await asyncio.to_thread(rebuild_catalog)
+    if agent_id is not None and agent_id not in catalog.by_id and state_backend.shared:
+        now = time.monotonic()
+        if now - _last_miss_rebuild >= STATE_POLL_INTERVAL:
+            _last_miss_rebuild = now
+            catalog = await asyncio.to_thread(rebuild_catalog)
+    return catalog
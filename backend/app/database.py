@@ -1,20 +1,133 @@
 import os
-from sqlalchemy import create_engine
+import importlib.util
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 # 从环境变量读取数据库URL，默认使用SQLite
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./luna_ai.db")
 
-# SQLite需要特殊的连接参数
-connect_args = {}
-if DATABASE_URL.startswith("sqlite"):
-    connect_args["check_same_thread"] = False
 
-engine = create_engine(DATABASE_URL, connect_args=connect_args)
+# 同步方言 -> 异步驱动；URL 中显式指定的同步驱动（如 postgresql+psycopg2）一并替换
+_ASYNC_DRIVERS = {
+    "sqlite": ("sqlite+aiosqlite", "aiosqlite"),
+    "postgresql": ("postgresql+asyncpg", "asyncpg"),
+    "postgres": ("postgresql+asyncpg", "asyncpg"),
+}
+
+
+def _async_database_url(url: str) -> str:
+    """将同步数据库URL转换为对应的异步驱动URL"""
+    scheme, sep, rest = url.partition(":")
+    dialect = scheme.split("+", 1)[0]
+    if not sep or dialect not in _ASYNC_DRIVERS:
+        return url
+    return _ASYNC_DRIVERS[dialect][0] + ":" + rest
+
+
+def _check_async_driver(url: str):
+    """异步驱动未安装时给出明确的错误，而不是在创建引擎时报 ModuleNotFoundError"""
+    scheme = url.partition(":")[0]
+    for async_scheme, module in _ASYNC_DRIVERS.values():
+        if scheme == async_scheme and importlib.util.find_spec(module) is None:
+            raise ValueError(
+                f"Async database driver '{module}' is not installed (required by {async_scheme}). "
+                f"Run: pip install -r requirements.txt"
+            )
+
+
+# 异步引擎（聊天流式接口等在事件循环中访问数据库的场景使用）
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_database_url(DATABASE_URL))
+_check_async_driver(ASYNC_DATABASE_URL)
+
+# ============ 引擎配置 ============
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    return _is_sqlite(url) and (":memory:" in url or url.rstrip("/").endswith("sqlite:"))
+
+
+# SQLite 每个连接建立时设置的 PRAGMA
+# WAL 让读写互不阻塞，synchronous=NORMAL 在 WAL 下仍保证崩溃一致性，
+# busy_timeout 让并发写等待锁而不是直接报 "database is locked"
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")),  # 负数表示 KiB
+    "temp_store": "MEMORY",
+}
+
+# PostgreSQL 等服务端数据库的连接池配置
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+
+def _engine_options(url: str) -> dict:
+    if _is_sqlite(url):
+        # SQLite需要特殊的连接参数
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def _configure_engine(sync_engine, url: str):
+    # 内存数据库不支持 WAL，保持默认
+    if _is_sqlite(url) and not _is_memory_sqlite(url):
+        event.listen(sync_engine, "connect", _apply_sqlite_pragmas)
+
+
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+_configure_engine(engine, DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL))
+_configure_engine(async_engine.sync_engine, ASYNC_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+
+def database_settings() -> dict:
+    """当前生效的数据库配置（SQLite 从连接上读取实际的 PRAGMA 值）"""
+    settings = {"url": engine.url.render_as_string(hide_password=True), "pool": type(engine.pool).__name__}
+    if _is_sqlite(DATABASE_URL):
+        with engine.connect() as conn:
+            for name in SQLITE_PRAGMAS:
+                settings[name] = conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+    else:
+        settings.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING,
+        )
+    return settings
+
 
 def get_db():
     db = SessionLocal()
@@ -24,5 +137,32 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    _create_missing_indexes()
+
+
+def _add_missing_columns():
+    """create_all 不会修改已存在的表，这里为模型中新增的可空列补上 ALTER TABLE"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+
+def _create_missing_indexes():
+    """create_all 不会为已存在的表补建新增的索引，这里逐个补齐"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
@@ -0,0 +1,185 @@
+"""
+日志配置：队列 + 后台线程输出，JSON 结构化记录
+
+请求处理（事件循环）中的 logger 调用只把记录放入内存队列，格式化和写 stdout
+由 QueueListener 的后台线程完成，不占用出字路径的时间。每条记录带上当前请求的
+request_id 和 agent_id（通过 contextvars 传递）。
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import logging
+import logging.handlers
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json / text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# 同一类高频告警（如逐行解析失败）在该间隔（秒）内只输出一次
+LOG_SAMPLE_INTERVAL = float(os.getenv("LOG_SAMPLE_INTERVAL", "10"))
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+agent_id_var: ContextVar[str] = ContextVar("agent_id", default="-")
+
+# 接入队列的 uvicorn 日志（访问日志每个请求一条）
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+
+class ContextFilter(logging.Filter):
+    """在调用方线程中把 request_id / agent_id 写入记录"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.agent_id = agent_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+            "agent_id": getattr(record, "agent_id", "-"),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃记录并计数，不阻塞调用方"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 只在调用方线程合并消息参数（参数可能之后被修改），JSON 编码留给后台线程
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+
+
+def setup_logging():
+    """替换根日志和 uvicorn 日志的输出为队列（重复调用无副作用）"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s [%(request_id)s agent=%(agent_id)s] %(message)s"
+        ))
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    _queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [_queue_handler]
+    root.setLevel(LOG_LEVEL)
+    for name in UVICORN_LOGGERS:
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+
+
+def stop_logging():
+    """停止后台线程，输出队列中剩余的记录"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> dict:
+    if _queue_handler is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "queued": _queue_handler.queue.qsize(),
+        "dropped": _queue_handler.dropped,
+        "suppressed": sum(count for _, count in _samples.values()),
+    }
+
+
+# ============ 采样 ============
+
+_samples: Dict[str, list] = {}  # key -> [上次输出时间, 期间被抑制的条数]
+
+
+def log_sampled(logger: logging.Logger, level: int, key: str, msg: str, *args):
+    """同一 key 的日志在 LOG_SAMPLE_INTERVAL 秒内只输出一次，并附带被抑制的条数"""
+    now = time.monotonic()
+    sample = _samples.get(key)
+    if sample is not None and now - sample[0] < LOG_SAMPLE_INTERVAL:
+        sample[1] += 1
+        return
+    suppressed = sample[1] if sample is not None else 0
+    _samples[key] = [now, 0]
+    if suppressed:
+        logger.log(level, msg + " (%d similar suppressed)", *args, suppressed)
+    else:
+        logger.log(level, msg, *args)
+
+
+# ============ 请求 ID ============
+
+class RequestContextMiddleware:
+    """纯 ASGI 中间件：为每个请求分配 request_id（优先沿用 X-Request-ID 请求头），并写回响应头"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        if not request_id:
+            request_id = uuid.uuid4().hex[:16]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id_var.reset(token)
@@ -1,4 +1,5 @@
 import os
+import logging
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -6,12 +7,27 @@ from dotenv import load_dotenv
 env_path = Path(__file__).parent.parent / ".env"
 load_dotenv(env_path)
 
+# 日志经队列由后台线程输出，在导入其他模块前配置
+from .logging_config import RequestContextMiddleware, setup_logging, stop_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.exc import IntegrityError
 from fastapi.middleware.cors import CORSMiddleware
-from .database import init_db, SessionLocal
+from .database import init_db, database_settings, engine, SessionLocal, async_engine
 from .models import User
-from .utils import hash_password
+from .catalog import rebuild_catalog
+from .metrics import MetricsMiddleware, instrument_engine, render as render_metrics
+from .utils import hash_password, password_hasher
 from .routers import auth, agents, admin, stats, feedback
+from .services.http_pool import init_pools, close_pools
+from .services.message_writer import message_writer
+from .services.session_store import session_store
+from .services.usage import backfill_usage_if_empty
+from .services.search import ensure_search_index
+from .state import start_listener, startup_lock, state_backend, stop_listener
 
 app = FastAPI(
     title="Luna AI Platform",
@@ -28,6 +44,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 运行指标：请求耗时、数据库耗时（/metrics）
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    instrument_engine(engine)
+    instrument_engine(async_engine.sync_engine)
+
+# 请求 ID（最外层，日志和响应头都能拿到）
+app.add_middleware(RequestContextMiddleware)
+
 # 注册路由
 app.include_router(auth.router)
 app.include_router(agents.router)
@@ -45,8 +71,10 @@ def create_default_admin():
             # 从环境变量读取管理员密码
             admin_password = os.getenv("ADMIN_DEFAULT_PASSWORD")
             if not admin_password:
-                print("Warning: ADMIN_DEFAULT_PASSWORD not set, skipping default admin creation.")
-                print("Set ADMIN_DEFAULT_PASSWORD environment variable to create default admin.")
+                logger.warning(
+                    "ADMIN_DEFAULT_PASSWORD not set, skipping default admin creation. "
+                    "Set ADMIN_DEFAULT_PASSWORD environment variable to create default admin."
+                )
                 return
 
             admin_user = User(
@@ -57,17 +85,47 @@ def create_default_admin():
                 is_active=True
             )
             db.add(admin_user)
-            db.commit()
-            print("Default admin created with username: admin")
-            print("Password is set from ADMIN_DEFAULT_PASSWORD environment variable")
+            try:
+                db.commit()
+            except IntegrityError:
+                # 多 worker 启动时已被其他进程创建
+                db.rollback()
+                return
+            logger.info("Default admin created with username: admin (password from ADMIN_DEFAULT_PASSWORD)")
     finally:
         db.close()
 
 
 @app.on_event("startup")
-def startup():
-    init_db()
-    create_default_admin()
+async def startup():
+    # 多 worker 同时启动时，建表和创建管理员串行执行
+    with startup_lock():
+        init_db()
+        ensure_search_index(engine)
+        create_default_admin()
+        with SessionLocal() as db:
+            backfill_usage_if_empty(db)
+    logger.info("Database settings: %s", ", ".join(f"{k}={v}" for k, v in database_settings().items()))
+    # 接收其他 worker 发布的目录、用户、会话失效事件
+    start_listener()
+    # 构建智能体目录，并为已配置的端点预建上游连接池
+    catalog = rebuild_catalog()
+    init_pools(agent.api_endpoint for agent in catalog.agents)
+    message_writer.start()
+    await session_store.purge_expired()
+    if state_backend.shared and session_store.stats()["backend"] == "memory":
+        logger.warning("STATE_BACKEND is shared but COZE_SESSION_STORE=memory, Coze sessions are per worker.")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_listener()
+    # 先把写入队列中的消息落库，再释放连接
+    await message_writer.stop()
+    await close_pools()
+    password_hasher.shutdown()
+    await async_engine.dispose()
+    stop_logging()
 
 
 @app.get("/")
@@ -78,3 +136,9 @@ def read_root():
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus 抓取接口（Nginx 只代理 /api，不对外暴露）"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,268 @@
+"""
+Prometheus 文本格式的运行指标（/metrics）
+
+计数器、直方图都是进程内的普通数值，热路径上不加锁：事件循环是单线程的，
+线程池中的同步路由在 GIL 下偶尔丢失一次自增，对监控统计可以忽略。
+多 worker 部署时每个 worker 各自统计，抓取到的是处理该次请求的 worker 的数据。
+"""
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 默认延迟分桶（秒），覆盖普通接口到整段流式回答
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+# 当前请求所属的路由模块，用于按模块统计数据库耗时（后台任务为 background）
+current_router: ContextVar[str] = ContextVar("current_router", default="background")
+
+_ROUTERS = {"auth", "agents", "admin", "stats", "feedback"}
+
+
+def router_label(path: str) -> str:
+    """/api/agents/1/chat -> agents"""
+    parts = path.split("/", 3)
+    if len(parts) > 2 and parts[1] == "api" and parts[2] in _ROUTERS:
+        return parts[2]
+    return "other"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in list(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    def dec(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    """每个标签组合一组分桶计数；observe 只增加一个桶，累计值在输出时计算"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._series: Dict[Tuple[str, ...], list] = {}  # labels -> [各桶计数..., 总和]
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+# ============ 指标定义 ============
+
+http_requests = Counter(
+    "luna_http_requests_total", "HTTP requests by route and status", ("method", "route", "status")
+)
+http_latency = Histogram(
+    "luna_http_request_duration_seconds", "HTTP request duration until the response is fully sent", ("method", "route")
+)
+sse_active = Gauge("luna_sse_streams_active", "Chat SSE streams currently open")
+upstream_ttft = Histogram(
+    "luna_upstream_ttft_seconds", "Time from calling Coze to the first answer chunk", ("agent",)
+)
+upstream_duration = Histogram(
+    "luna_upstream_stream_duration_seconds", "Total duration of a Coze answer stream", ("agent",)
+)
+upstream_retries = Counter("luna_upstream_retries_total", "Coze call retries", ("reason",))
+upstream_timeouts = Counter("luna_upstream_timeouts_total", "Coze calls that timed out")
+upstream_coalesced = Counter(
+    "luna_upstream_coalesced_total", "Chat requests that joined an identical in-flight Coze call", ("agent",)
+)
+chat_messages_dropped = Counter(
+    "luna_chat_messages_dropped_total", "Chat messages the write-behind queue failed to persist"
+)
+db_query_time = Histogram(
+    "luna_db_query_duration_seconds", "Database statement execution time", ("router",), DB_BUCKETS
+)
+
+_metrics = [
+    http_requests, http_latency, sse_active, upstream_ttft, upstream_duration,
+    upstream_retries, upstream_timeouts, upstream_coalesced, chat_messages_dropped, db_query_time,
+]
+# 抓取时才读取的指标（如缓存命中数），返回 Prometheus 文本行
+_collectors: List[Callable[[], Iterable[str]]] = []
+
+
+def register_collector(collector: Callable[[], Iterable[str]]):
+    _collectors.append(collector)
+
+
+def cache_collector(name: str, caches: Callable[[], Dict[str, "object"]]) -> Callable[[], Iterable[str]]:
+    """把若干 TTLCache 的命中/未命中数输出为计数器"""
+    def collect() -> Iterable[str]:
+        stats = {label: cache.stats() for label, cache in caches().items()}
+        yield f"# HELP {name}_hits_total Cache hits"
+        yield f"# TYPE {name}_hits_total counter"
+        for label, s in stats.items():
+            yield f'{name}_hits_total{{cache="{label}"}} {s["hits"]}'
+        yield f"# HELP {name}_misses_total Cache misses"
+        yield f"# TYPE {name}_misses_total counter"
+        for label, s in stats.items():
+            yield f'{name}_misses_total{{cache="{label}"}} {s["misses"]}'
+        yield f"# HELP {name}_size Cached entries"
+        yield f"# TYPE {name}_size gauge"
+        for label, s in stats.items():
+            yield f'{name}_size{{cache="{label}"}} {s["size"]}'
+    return collect
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+
+# ============ 数据库耗时 ============
+
+def instrument_engine(sync_engine):
+    """在引擎上记录每条语句的执行时间（异步引擎传入 async_engine.sync_engine）"""
+    from sqlalchemy import event
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        db_query_time.observe(time.perf_counter() - started, current_router.get())
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+
+# ============ 请求中间件 ============
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件：记录每个路由的请求数和耗时
+
+    不使用 BaseHTTPMiddleware，流式响应不经过额外的队列转发。
+    路由标签取匹配到的路由模板（如 /api/agents/{agent_id}/chat），未匹配的请求归为 unmatched。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths: Optional[Dict[object, str]] = None
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._route_paths is None:
+            self._route_paths = {
+                route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")
+            }
+        return self._route_paths.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        token = current_router.set(router_label(scope["path"]))
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_router.reset(token)
+            route = self._route(scope)
+            method = scope["method"]
+            http_requests.inc(method, route, str(status_code))
+            http_latency.observe(time.perf_counter() - started, method, route)
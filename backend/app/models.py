@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, Float, String, Text, DateTime, Boolean, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -40,6 +40,14 @@ class Agent(Base):
     api_token = Column(Text, nullable=False)
     project_id = Column(String(50), nullable=False)
 
+    # 调用限流（按 project_id 的令牌桶），为空时使用全局默认值
+    rate_limit = Column(Float, nullable=True)  # 每秒请求数
+    rate_burst = Column(Integer, nullable=True)  # 突发容量
+
+    # 并发隔离（按智能体），为空时使用全局默认值
+    max_in_flight = Column(Integer, nullable=True)  # 同时进行的上游调用上限
+    queue_depth = Column(Integer, nullable=True)  # 超出上限后的最大排队数
+
     # 权限与状态
     tier_required = Column(String(20), default="365")  # 最低会员等级
     status = Column(String(20), default="active")  # active / coming_soon
@@ -47,12 +55,20 @@ class Agent(Base):
 
     # 快捷提问（JSON数组）
     quick_prompts = Column(Text, default="[]")
+    # 是否缓存快捷提问的回答（为空视为关闭）
+    answer_cache = Column(Boolean, nullable=True, default=False)
+    # 无状态智能体（回答不依赖会话上下文）：相同问题的并发请求合并为一次上游调用
+    stateless = Column(Boolean, nullable=True, default=False)
 
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # 对话历史按 (用户, 智能体) 做 id 游标分页
+        Index("ix_chat_messages_user_agent_id", "user_id", "agent_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
@@ -64,3 +80,26 @@ class ChatMessage(Base):
     # 关联
     user = relationship("User", backref="messages")
     agent = relationship("Agent", backref="messages")
+
+
+class UserAgentUsage(Base):
+    """用户使用各智能体的累计次数（随消息写入增量维护，个人中心统计直接读取）"""
+    __tablename__ = "user_agent_usage"
+    __table_args__ = (
+        # 最常用的智能体
+        Index("ix_user_agent_usage_user_count", "user_id", "message_count"),
+    )
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    agent_id = Column(Integer, ForeignKey("agents.id"), primary_key=True)
+    message_count = Column(Integer, nullable=False, default=0)  # 用户发送的消息数
+    last_used_at = Column(DateTime, nullable=True)
+
+
+class CozeSession(Base):
+    """Coze 会话（COZE_SESSION_STORE=database 时使用，多 worker 共享）"""
+    __tablename__ = "coze_sessions"
+
+    key = Column(String(100), primary_key=True)  # project_id:user_id
+    session_id = Column(String(64), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)  # 最后使用时间
@@ -1,6 +1,7 @@
 import json
-from typing import Optional
-from .models import User, Agent
+from typing import FrozenSet
+from .cache import TTLCache
+from .catalog import Catalog
 
 # 会员等级配额
 TIER_LIMITS = {
@@ -9,29 +10,61 @@ TIER_LIMITS = {
     "3980": {"custom": -1, "general": -1}  # -1=无限
 }
 
+# 已编译的权限集合：(用户版本, 目录版本) -> 可访问的智能体ID集合
+_access_cache = TTLCache(maxsize=10000, ttl=600)
 
-def can_access_agent(user: Optional[User], agent: Agent) -> bool:
-    """判断用户是否有权限访问智能体"""
-    # 未登录用户不能访问
-    if user is None:
-        return False
 
+def _binded_agent_ids(user) -> FrozenSet[int]:
+    try:
+        binded = json.loads(user.binded_agents or "[]")
+    except json.JSONDecodeError:
+        return frozenset()
+    if not isinstance(binded, list):
+        return frozenset()
+    return frozenset(agent_id for agent_id in binded if isinstance(agent_id, int))
+
+
+def _tier_allows(tier: str, binded: FrozenSet[int], agent) -> bool:
     # 游客不能访问
-    if user.tier == "guest":
+    if tier == "guest":
         return False
 
     # 3980全部可用
-    if user.tier == "3980":
+    if tier == "3980":
         return True
 
     # 365会员检查限制
     if agent.category == "custom":
         # 定制智能体必须在绑定列表中
-        try:
-            binded = json.loads(user.binded_agents or "[]")
-        except json.JSONDecodeError:
-            binded = []
         return agent.id in binded
     else:
         # 通用智能体：365会员可用所有tier_required="365"的通用智能体
         return agent.tier_required == "365"
+
+
+def accessible_agent_ids(user, catalog: Catalog) -> FrozenSet[int]:
+    """
+    计算用户可访问的智能体ID集合
+
+    结果按用户版本（等级、绑定列表）和目录版本缓存，任一变化都会重新编译；
+    之后每个智能体的权限判断只是一次集合查找。
+    """
+    # 未登录用户不能访问
+    if user is None:
+        return frozenset()
+
+    key = (user.id, user.tier, user.binded_agents, catalog.version)
+    ids = _access_cache.get(key)
+    if ids is None:
+        binded = _binded_agent_ids(user)
+        ids = frozenset(agent.id for agent in catalog.agents if _tier_allows(user.tier, binded, agent))
+        _access_cache.set(key, ids)
+    return ids
+
+
+def can_access_agent(user, agent) -> bool:
+    """判断用户是否有权限访问智能体"""
+    # 未登录用户不能访问
+    if user is None:
+        return False
+    return _tier_allows(user.tier, _binded_agent_ids(user), agent)
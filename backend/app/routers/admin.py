@@ -1,5 +1,7 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import date, datetime
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from ..database import get_db
 from ..models import User, Agent
@@ -7,7 +9,22 @@ from ..schemas import (
     AgentCreate, AgentUpdate, AgentAdminResponse,
     UserResponse, UserAdminUpdate
 )
-from ..auth import require_admin
+from ..catalog import refresh_catalog
+from ..auth import (
+    UserSnapshot, require_admin, require_admin_download, create_download_token,
+    DOWNLOAD_TOKEN_SECONDS, invalidate_user, auth_cache_stats
+)
+from ..services.http_pool import pool_stats
+from ..services.message_writer import message_writer
+from ..services.answer_cache import answer_cache
+from ..services.export import EXPORT_FORMATS, feedbacks_query, messages_query, stream_export, users_query
+from ..services.rate_limit import rate_limiter
+from ..services.bulkhead import bulkheads
+from ..services.circuit_breaker import breaker_state, breaker_stats
+from ..services.session_store import session_store
+from ..utils import password_hasher
+from ..logging_config import logging_stats
+from .agents import chat_streams, upstream_flights
 
 router = APIRouter(prefix="/api/admin", tags=["管理后台"])
 
@@ -17,18 +34,23 @@ router = APIRouter(prefix="/api/admin", tags=["管理后台"])
 @router.get("/agents", response_model=List[AgentAdminResponse])
 def list_agents_admin(
     db: Session = Depends(get_db),
-    admin: User = Depends(require_admin)
+    admin: UserSnapshot = Depends(require_admin)
 ):
-    """获取智能体列表（含完整配置）"""
+    """获取智能体列表（含完整配置和上游熔断状态）"""
     agents = db.query(Agent).order_by(Agent.sort_order, Agent.id).all()
-    return [AgentAdminResponse.model_validate(a) for a in agents]
+    return [
+        AgentAdminResponse.model_validate(a).model_copy(
+            update={"circuit_state": breaker_state(a.api_endpoint, a.project_id)}
+        )
+        for a in agents
+    ]
 
 
 @router.post("/agents", response_model=AgentAdminResponse)
 def create_agent(
     data: AgentCreate,
     db: Session = Depends(get_db),
-    admin: User = Depends(require_admin)
+    admin: UserSnapshot = Depends(require_admin)
 ):
     """添加智能体"""
     agent = Agent(
@@ -39,13 +61,21 @@ def create_agent(
         api_endpoint=data.api_endpoint,
         api_token=data.api_token,
         project_id=data.project_id,
+        rate_limit=data.rate_limit,
+        rate_burst=data.rate_burst,
+        max_in_flight=data.max_in_flight,
+        queue_depth=data.queue_depth,
         tier_required=data.tier_required,
         status=data.status,
-        sort_order=data.sort_order
+        sort_order=data.sort_order,
+        quick_prompts=data.quick_prompts,
+        answer_cache=data.answer_cache,
+        stateless=data.stateless
     )
     db.add(agent)
     db.commit()
     db.refresh(agent)
+    refresh_catalog(db)
     return AgentAdminResponse.model_validate(agent)
 
 
@@ -54,7 +84,7 @@ def update_agent(
     agent_id: int,
     data: AgentUpdate,
     db: Session = Depends(get_db),
-    admin: User = Depends(require_admin)
+    admin: UserSnapshot = Depends(require_admin)
 ):
     """修改智能体"""
     agent = db.query(Agent).filter(Agent.id == agent_id).first()
@@ -72,6 +102,7 @@ def update_agent(
 
     db.commit()
     db.refresh(agent)
+    refresh_catalog(db)
     return AgentAdminResponse.model_validate(agent)
 
 
@@ -79,7 +110,7 @@ def update_agent(
 def delete_agent(
     agent_id: int,
     db: Session = Depends(get_db),
-    admin: User = Depends(require_admin)
+    admin: UserSnapshot = Depends(require_admin)
 ):
     """删除智能体"""
     agent = db.query(Agent).filter(Agent.id == agent_id).first()
@@ -91,15 +122,27 @@ def delete_agent(
 
     db.delete(agent)
     db.commit()
+    refresh_catalog(db)
+    answer_cache.purge(agent_id)
     return {"message": "删除成功"}
 
 
+@router.delete("/agents/{agent_id}/answer-cache")
+def purge_answer_cache(
+    agent_id: int,
+    admin: UserSnapshot = Depends(require_admin)
+):
+    """清除智能体的快捷提问答案缓存（上游智能体内容更新后使用）"""
+    removed = answer_cache.purge(agent_id)
+    return {"message": f"已清除 {removed} 条缓存回答", "removed": removed}
+
+
 # ============ 用户管理 ============
 
 @router.get("/users", response_model=List[UserResponse])
 def list_users(
     db: Session = Depends(get_db),
-    admin: User = Depends(require_admin)
+    admin: UserSnapshot = Depends(require_admin)
 ):
     """获取用户列表"""
     users = db.query(User).order_by(User.id).all()
@@ -111,7 +154,7 @@ def update_user(
     user_id: int,
     data: UserAdminUpdate,
     db: Session = Depends(get_db),
-    admin: User = Depends(require_admin)
+    admin: UserSnapshot = Depends(require_admin)
 ):
     """修改用户（tier, tier_expire_at, binded_agents, is_active）"""
     user = db.query(User).filter(User.id == user_id).first()
@@ -129,4 +172,67 @@ def update_user(
 
     db.commit()
     db.refresh(user)
+    invalidate_user(user.id)
     return UserResponse.model_validate(user)
+
+
+# ============ 数据导出 ============
+
+@router.post("/download-token")
+def issue_download_token(admin: UserSnapshot = Depends(require_admin)):
+    """签发短期下载凭证：前端把它放进导出链接，由浏览器直接流式下载到磁盘"""
+    return {"token": create_download_token(admin.id), "expires_in": DOWNLOAD_TOKEN_SECONDS}
+
+
+@router.get("/export/{dataset}")
+def export_data(
+    dataset: Literal["users", "feedbacks", "messages"],
+    fmt: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    start_date: Optional[date] = Query(None, description="创建日期起（含）"),
+    end_date: Optional[date] = Query(None, description="创建日期止（含）"),
+    user_id: Optional[int] = Query(None, description="仅对话记录：只导出该用户的消息"),
+    agent_id: Optional[int] = Query(None, description="仅对话记录：只导出与该智能体的消息"),
+    compress: bool = Query(True, description="gzip 压缩"),
+    admin: UserSnapshot = Depends(require_admin_download)
+):
+    """流式导出用户、反馈或对话记录（按 id 顺序，内存占用与行数无关）"""
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="开始日期不能晚于结束日期"
+        )
+
+    if dataset == "users":
+        query = users_query(start_date, end_date)
+    elif dataset == "feedbacks":
+        query = feedbacks_query(start_date, end_date)
+    else:
+        query = messages_query(start_date, end_date, user_id, agent_id)
+
+    filename = f"{dataset}-{datetime.now():%Y%m%d-%H%M%S}.{fmt}" + (".gz" if compress else "")
+    return StreamingResponse(
+        stream_export(query, fmt, compress),
+        media_type="application/gzip" if compress else EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+# ============ 运行状态 ============
+
+@router.get("/runtime")
+def runtime_stats(admin: UserSnapshot = Depends(require_admin)):
+    """上游连接池、熔断、限流、并发隔离、合并的上游调用、消息写入队列、答案缓存、认证缓存、密码哈希、日志队列等运行时状态"""
+    return {
+        "upstream_pools": pool_stats(),
+        "circuit_breakers": breaker_stats(),
+        "rate_limits": rate_limiter.stats(),
+        "bulkheads": bulkheads.stats(),
+        "chat_streams": chat_streams.stats(),
+        "upstream_flights": upstream_flights.stats(),
+        "answer_cache": answer_cache.stats(),
+        "chat_writer": message_writer.stats(),
+        "auth_cache": auth_cache_stats(),
+        "coze_sessions": session_store.stats(),
+        "password_hashing": password_hasher.stats(),
+        "logging": logging_stats(),
+    }
@@ -1,62 +1,71 @@
-import json
+import time
+import hashlib
 import logging
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from ..database import get_db, SessionLocal
-from ..models import User, Agent, ChatMessage
-from ..schemas import AgentResponse, ChatRequest, ChatMessageResponse, ChatHistoryResponse
-from ..auth import get_current_user, get_current_user_optional
-from ..permissions import can_access_agent
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import Response, StreamingResponse
+from pydantic import TypeAdapter
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..cache import TTLCache
+from ..catalog import AgentEntry, Catalog, get_catalog
+from ..database import get_async_db
+from ..metrics import sse_active, upstream_coalesced, upstream_duration, upstream_ttft
+from ..logging_config import agent_id_var
+from ..models import ChatMessage, UserAgentUsage
+from ..schemas import (
+    AgentResponse, ChatRequest, ChatMessageResponse, ChatHistoryResponse,
+    ChatSearchHit, ChatSearchResponse
+)
+from ..auth import UserSnapshot, get_current_user, get_current_user_optional
+from ..permissions import accessible_agent_ids
 from ..services.coze import call_coze_agent, clear_session
+from ..services.message_writer import message_writer
+from ..services.search import make_snippet, parse_terms, search_messages
+from ..services.answer_cache import answer_cache, config_version, normalize_prompt, replay_chunks
+from ..services.rate_limit import rate_limiter
+from ..services.bulkhead import bulkheads, tier_priority
+from ..services.broadcast import BroadcastStream, StreamRegistry
+from ..services.sse import DONE_FRAME, coalesce_chunks, content_frame, error_frame, queue_frame
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/agents", tags=["智能体"])
 
+# 对话历史分页
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
 
-@router.get("", response_model=List[AgentResponse])
-def list_agents(
-    db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user_optional)
-):
-    """获取智能体列表"""
-    agents = db.query(Agent).order_by(Agent.sort_order, Agent.id).all()
-
-    result = []
-    for agent in agents:
-        agent_dict = {
-            "id": agent.id,
-            "name": agent.name,
-            "icon": agent.icon,
-            "description": agent.description,
-            "category": agent.category,
-            "tier_required": agent.tier_required,
-            "status": agent.status,
-            "sort_order": agent.sort_order,
-            "created_at": agent.created_at,
-            "can_access": can_access_agent(current_user, agent)
-        }
-        result.append(AgentResponse(**agent_dict))
+# 对话记录检索分页（按相关度排序，用 offset 翻页，限制最大深度）
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 50
+SEARCH_MAX_OFFSET = 1000
 
-    return result
+# 智能体列表响应体缓存：(目录版本, 可访问集合) -> JSON
+_list_body_cache = TTLCache(maxsize=256, ttl=600)
+_agent_list_adapter = TypeAdapter(List[AgentResponse])
 
+# 进行中的对话输出流：(用户, 智能体, 幂等键) -> BroadcastStream
+# 多 worker 时幂等键同时登记在共享状态中，重发请求落到其他 worker 也不会重复调用上游
+chat_streams = StreamRegistry(shared_prefix="chat_stream")
 
-@router.get("/{agent_id}", response_model=AgentResponse)
-def get_agent(
-    agent_id: int,
-    db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user_optional)
-):
-    """获取单个智能体详情"""
-    agent = db.query(Agent).filter(Agent.id == agent_id).first()
-    if not agent:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="智能体不存在"
-        )
+# 无状态智能体进行中的上游调用：(智能体, 规范化问题, 配置版本) -> BroadcastStream，结束即移除
+upstream_flights = StreamRegistry(ttl=0)
 
+
+def _etag_response(request: Request, body: bytes) -> Response:
+    """带 ETag 的 JSON 响应；客户端缓存仍有效时返回 304"""
+    etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        if "*" in tags or etag in tags or f"W/{etag}" in tags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _agent_response(agent: AgentEntry, can_access: bool, with_prompts: bool = False) -> AgentResponse:
     return AgentResponse(
         id=agent.id,
         name=agent.name,
@@ -66,77 +75,204 @@ def get_agent(
         tier_required=agent.tier_required,
         status=agent.status,
         sort_order=agent.sort_order,
+        quick_prompts=agent.quick_prompts if with_prompts else "[]",
         created_at=agent.created_at,
-        can_access=can_access_agent(current_user, agent)
+        can_access=can_access
     )
 
 
-@router.get("/{agent_id}/history", response_model=ChatHistoryResponse)
-def get_chat_history(
-    agent_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    """获取与智能体的对话历史"""
-    # 检查智能体是否存在
-    agent = db.query(Agent).filter(Agent.id == agent_id).first()
+def _get_catalog_agent(catalog: Catalog, agent_id: int) -> AgentEntry:
+    agent = catalog.get(agent_id)
     if not agent:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="智能体不存在"
         )
+    return agent
+
+
+@router.get("", response_model=List[AgentResponse])
+async def list_agents(
+    request: Request,
+    current_user: Optional[UserSnapshot] = Depends(get_current_user_optional)
+):
+    """获取智能体列表"""
+    catalog = await get_catalog()
+    allowed_ids = accessible_agent_ids(current_user, catalog)
+
+    # 同一目录版本下，可访问集合相同的用户得到完全相同的响应体，直接复用
+    cache_key = (catalog.version, allowed_ids)
+    body = _list_body_cache.get(cache_key)
+    if body is None:
+        body = _agent_list_adapter.dump_json([
+            _agent_response(agent, agent.id in allowed_ids)
+            for agent in catalog.agents
+        ])
+        _list_body_cache.set(cache_key, body)
+
+    return _etag_response(request, body)
+
+
+# 需在 /{agent_id} 之前注册，否则 "search" 会被当作 agent_id 解析
+@router.get("/search", response_model=ChatSearchResponse)
+async def search_chat_history(
+    q: str = Query(..., min_length=1, max_length=100, description="检索词，空格分隔的多个词需同时出现"),
+    agent_id: Optional[int] = Query(None, description="只检索与该智能体的对话"),
+    offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET),
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    """检索自己的对话记录，返回命中片段及高亮位置"""
+    terms = parse_terms(q)
+    if not terms:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="请输入检索内容"
+        )
+
+    messages, has_more = await search_messages(db, current_user.id, terms, agent_id, limit, offset)
+
+    results = []
+    for message in messages:
+        snippet, highlights = make_snippet(message.content, terms)
+        results.append(ChatSearchHit(
+            id=message.id,
+            agent_id=message.agent_id,
+            role=message.role,
+            snippet=snippet,
+            highlights=highlights,
+            created_at=message.created_at
+        ))
+    return ChatSearchResponse(
+        results=results,
+        has_more=has_more,
+        next_offset=offset + limit if has_more else None
+    )
+
+
+@router.get("/{agent_id}", response_model=AgentResponse)
+async def get_agent(
+    agent_id: int,
+    request: Request,
+    current_user: Optional[UserSnapshot] = Depends(get_current_user_optional)
+):
+    """获取单个智能体详情"""
+    catalog = await get_catalog(agent_id)
+    agent = _get_catalog_agent(catalog, agent_id)
+    can_access = agent.id in accessible_agent_ids(current_user, catalog)
+    body = _agent_response(agent, can_access, with_prompts=True).model_dump_json().encode()
+    return _etag_response(request, body)
+
 
-    # 获取历史消息
-    messages = db.query(ChatMessage).filter(
+@router.get("/{agent_id}/history", response_model=ChatHistoryResponse)
+async def get_chat_history(
+    agent_id: int,
+    before_id: Optional[int] = Query(None, description="只返回 id 小于该值的消息"),
+    limit: int = Query(HISTORY_DEFAULT_LIMIT, ge=1, le=HISTORY_MAX_LIMIT),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    """
+    获取与智能体的对话历史
+
+    从最新消息开始按 id 游标向前分页：不传 before_id 返回最新的 limit 条，
+    继续加载时传入上一页返回的 next_before_id。每页内按时间正序排列。
+    """
+    # 检查智能体是否存在
+    _get_catalog_agent(await get_catalog(agent_id), agent_id)
+
+    # 获取历史消息（多取一条用于判断是否还有更早的消息）
+    query = select(ChatMessage).where(
         ChatMessage.user_id == current_user.id,
         ChatMessage.agent_id == agent_id
-    ).order_by(ChatMessage.created_at).all()
+    )
+    if before_id is not None:
+        query = query.where(ChatMessage.id < before_id)
+    result = await db.execute(query.order_by(ChatMessage.id.desc()).limit(limit + 1))
+    messages = result.scalars().all()
+
+    has_more = len(messages) > limit
+    messages = list(reversed(messages[:limit]))
 
-    return ChatHistoryResponse(messages=messages)
+    return ChatHistoryResponse(
+        messages=messages,
+        has_more=has_more,
+        next_before_id=messages[0].id if has_more else None
+    )
 
 
 @router.delete("/{agent_id}/history")
-def clear_chat_history(
+async def clear_chat_history(
     agent_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserSnapshot = Depends(get_current_user)
 ):
     """清空与智能体的对话历史"""
     # 获取智能体的 project_id
-    agent = db.query(Agent).filter(Agent.id == agent_id).first()
+    agent = (await get_catalog(agent_id)).get(agent_id)
 
-    # 清除数据库中的对话记录
-    db.query(ChatMessage).filter(
-        ChatMessage.user_id == current_user.id,
-        ChatMessage.agent_id == agent_id
-    ).delete()
-    db.commit()
+    # 清除数据库中的对话记录（先等待该对话在写入队列中的消息落库，避免删除后又被写回）
+    if not await message_writer.wait_flushed(current_user.id, agent_id):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="消息正在保存，请稍后再试"
+        )
+    await db.execute(
+        delete(ChatMessage).where(
+            ChatMessage.user_id == current_user.id,
+            ChatMessage.agent_id == agent_id
+        )
+    )
+    await db.execute(
+        delete(UserAgentUsage).where(
+            UserAgentUsage.user_id == current_user.id,
+            UserAgentUsage.agent_id == agent_id
+        )
+    )
+    await db.commit()
 
     # 同时清除 Coze 会话缓存，让下次对话开始新会话
     if agent and agent.project_id:
-        clear_session(agent.project_id, current_user.id)
+        await clear_session(agent.project_id, current_user.id)
 
     return {"message": "对话记录已清空"}
 
 
+def _last_event_id(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+async def _sse_frames(stream: BroadcastStream, start: int):
+    """把输出流中的帧加上 SSE id 发给一个客户端；客户端断开不影响生成"""
+    frames = stream.subscribe(start)
+    sse_active.inc()
+    try:
+        async for seq, frame in frames:
+            yield f"id: {seq}\n{frame}"
+    finally:
+        sse_active.dec()
+        await frames.aclose()
+
+
 @router.post("/{agent_id}/chat")
 async def chat_with_agent(
     agent_id: int,
     request: ChatRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    http_request: Request,
+    current_user: UserSnapshot = Depends(get_current_user)
 ):
     """与智能体对话（SSE流式响应）"""
-    # 1. 获取智能体
-    agent = db.query(Agent).filter(Agent.id == agent_id).first()
-    if not agent:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="智能体不存在"
-        )
+    agent_id_var.set(str(agent_id))
+    # 1. 获取智能体（内存目录）
+    catalog = await get_catalog(agent_id)
+    agent = _get_catalog_agent(catalog, agent_id)
 
     # 2. 权限检查
-    if not can_access_agent(current_user, agent):
+    if agent.id not in accessible_agent_ids(current_user, catalog):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="无权访问此智能体，请升级会员"
@@ -149,70 +285,211 @@ async def chat_with_agent(
             detail="该智能体暂未开放"
         )
 
-    # 4. 提取需要的字段到局部变量（避免Session关闭后无法访问）
-    api_endpoint = agent.api_endpoint
-    api_token = agent.api_token
-    project_id = agent.project_id
+    # 4. 断线重连：同一幂等键的请求接到仍在进行（或刚结束）的输出流上，从 Last-Event-ID 之后续传，
+    #    不重复保存用户消息，也不重复调用上游
     user_id = current_user.id
-    message = request.message
-
-    # 5. 保存用户消息
-    user_message = ChatMessage(
-        user_id=user_id,
-        agent_id=agent_id,
-        role="user",
-        content=message
-    )
-    db.add(user_message)
-    db.commit()
-
-    # 6. 调用Coze API，返回SSE流，并保存AI回复
-    full_response = []
-
-    async def generate():
+    idempotency_key = request.idempotency_key or http_request.headers.get("idempotency-key")
+    stream_key = (user_id, agent_id, idempotency_key) if idempotency_key else None
+    last_event_id = _last_event_id(http_request.headers.get("last-event-id"))
+    stream = chat_streams.get(stream_key) if stream_key else None
+    if stream is not None:
+        chat_streams.attached += 1
+    elif last_event_id is not None:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="该回答已结束，请刷新查看对话记录"
+        )
+    else:
+        # 同一幂等键的流在其他 worker 上：进行中返回 409，已结束返回 410
+        owner_state = await chat_streams.claim(stream_key) if stream_key else None
+        if owner_state == "active":
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="该消息正在回答中，请稍后刷新查看对话记录"
+            )
+        if owner_state is not None:
+            raise HTTPException(
+                status_code=status.HTTP_410_GONE,
+                detail="该回答已结束，请刷新查看对话记录"
+            )
         try:
-            async for chunk in call_coze_agent(
-                api_endpoint,
-                api_token,
-                project_id,
-                message,
-                user_id=user_id  # 传递用户ID用于会话管理
-            ):
-                full_response.append(chunk)
-                # SSE格式返回给前端
-                yield f"data: {json.dumps({'content': chunk}, ensure_ascii=False)}\n\n"
-
-            # 保存AI回复（使用新的Session）
-            if full_response:
-                new_db = SessionLocal()
-                try:
-                    ai_message = ChatMessage(
-                        user_id=user_id,
-                        agent_id=agent_id,
-                        role="assistant",
-                        content="".join(full_response)
-                    )
-                    new_db.add(ai_message)
-                    new_db.commit()
-                    logger.info(f"Saved AI response: {len(''.join(full_response))} chars")
-                finally:
-                    new_db.close()
-
-            yield "data: [DONE]\n\n"
-        except HTTPException as e:
-            # 将错误信息也通过SSE返回
-            yield f"data: {json.dumps({'error': e.detail}, ensure_ascii=False)}\n\n"
-            yield "data: [DONE]\n\n"
-        except Exception as e:
-            logger.error(f"Chat error: {e}")
-            yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
-            yield "data: [DONE]\n\n"
+            stream = await _start_chat_stream(agent, current_user, request.message, stream_key)
+        except BaseException:
+            if stream_key:
+                await chat_streams.release(stream_key)
+            raise
 
     return StreamingResponse(
-        generate(),
+        _sse_frames(stream, last_event_id + 1 if last_event_id is not None else 0),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive"
         }
     )
+
+
+def _joinable_flight(flight_key: Optional[tuple]) -> Optional[BroadcastStream]:
+    flight = upstream_flights.get(flight_key) if flight_key is not None else None
+    return flight if flight is not None and not flight.closed else None
+
+
+async def _start_chat_stream(
+    agent: AgentEntry,
+    current_user: UserSnapshot,
+    message: str,
+    stream_key: Optional[tuple]
+) -> BroadcastStream:
+    """限流、保存用户消息，并在后台任务中把上游输出转发到 BroadcastStream"""
+    # 提取需要的字段到局部变量
+    agent_id = agent.id
+    project_id = agent.project_id
+    user_id = current_user.id
+
+    # 开启了答案缓存的智能体，快捷提问命中缓存时不调用上游，也不占用限流和并发名额
+    cache_key = answer_cache.key(agent, message)
+    cached_answer = answer_cache.get(cache_key) if cache_key is not None else None
+
+    # 无状态智能体：相同问题的并发请求共用进行中的上游调用，同样不占用限流和并发名额
+    flight_key = (agent_id, normalize_prompt(message), config_version(agent)) if agent.stateless else None
+    flight = _joinable_flight(flight_key) if cached_answer is None else None
+    upstream_needed = cached_answer is None and flight is None
+
+    if upstream_needed:
+        # 并发隔离：该智能体的并发和排队都已满时直接返回 503
+        bulkheads.get(agent).check()
+        # 先登记上游调用，限流等待期间相同问题的请求即可加入；最后一个订阅者离开时取消调用
+        flight = BroadcastStream(cancel_when_idle=True)
+        if flight_key is not None:
+            upstream_flights.add(flight_key, flight)
+
+    # 先登记输出流，限流等待期间同一幂等键的重发请求也会接到这个流上
+    # 没有幂等键的请求无法续传，客户端断开即取消上游调用
+    stream = BroadcastStream(cancel_when_idle=stream_key is None)
+    if stream_key is not None:
+        chat_streams.add(stream_key, stream)
+
+    try:
+        # 按 project_id 限流：排队等待令牌，预计等待过长直接返回 429
+        if upstream_needed:
+            await rate_limiter.acquire(project_id, agent.rate_limit, agent.rate_burst)
+
+        # 保存用户消息（进入后台批量写入队列）
+        await message_writer.submit(user_id, agent_id, "user", message)
+    except BaseException as e:
+        # 已接上的重发请求、已加入的相同问题请求收到同样的错误，之后的请求重新开始
+        if stream_key is not None:
+            chat_streams.discard(stream_key, stream)
+        if isinstance(e, HTTPException):
+            stream.append(error_frame(e.detail))
+            if upstream_needed:
+                flight.append(error_frame(e.detail))
+        stream.append(DONE_FRAME)
+        stream.close()
+        if upstream_needed:
+            flight.close()
+        raise
+
+    if cached_answer is not None:
+        stream.start(_replay_answer(stream, user_id, agent_id, cached_answer))
+        return stream
+
+    if upstream_needed:
+        flight.start(_call_upstream(flight, agent, tier_priority(current_user.tier), message, user_id, cache_key))
+    else:
+        upstream_flights.attached += 1
+        upstream_coalesced.inc(str(agent_id))
+
+    stream.start(_relay_answer(stream, flight, user_id, agent_id))
+    return stream
+
+
+async def _call_upstream(
+    flight: BroadcastStream,
+    agent: AgentEntry,
+    priority: int,
+    message: str,
+    user_id: int,
+    cache_key: Optional[tuple]
+):
+    """调用Coze API，SSE 帧（不含结束帧）写入 flight，成功时 flight.result 为完整回答"""
+    ticket = None
+    upstream_started = None
+    metric_label = str(agent.id)
+    full_response = []
+    try:
+        # 占用该智能体的调用名额，排队期间推送排队位置（高等级会员优先）
+        ticket = bulkheads.get(agent).enter(priority)
+        queued = False
+        async for position in ticket.wait():
+            queued = True
+            flight.append(queue_frame(position))
+        if queued:
+            # 位置 0 表示已轮到，前端切回“思考中”
+            flight.append(queue_frame(0))
+
+        upstream_started = time.perf_counter()
+        upstream = call_coze_agent(
+            agent.api_endpoint,
+            agent.api_token,
+            agent.project_id,
+            message,
+            user_id=user_id  # 传递用户ID用于会话管理
+        )
+        # 合并细碎的上游文本块后再编码为SSE帧
+        async for chunk in coalesce_chunks(upstream):
+            if not full_response:
+                upstream_ttft.observe(time.perf_counter() - upstream_started, metric_label)
+            full_response.append(chunk)
+            flight.append(content_frame(chunk))
+
+        if full_response:
+            flight.result = "".join(full_response)
+            if cache_key is not None:
+                answer_cache.set(cache_key, flight.result)
+    except HTTPException as e:
+        # 将错误信息也通过SSE返回
+        flight.append(error_frame(e.detail))
+    except Exception as e:
+        logger.error("Chat error: %s", e)
+        flight.append(error_frame(str(e)))
+    finally:
+        if upstream_started is not None:
+            upstream_duration.observe(time.perf_counter() - upstream_started, metric_label)
+        if ticket is not None:
+            ticket.release()
+
+
+async def _relay_answer(stream: BroadcastStream, flight: BroadcastStream, user_id: int, agent_id: int):
+    """把上游调用的输出转发给一个请求，结束后保存该用户自己的AI回复"""
+    frames = flight.subscribe()
+    try:
+        async for _, frame in frames:
+            stream.append(frame)
+
+        # 保存AI回复（进入后台批量写入队列）
+        if flight.result:
+            await message_writer.submit(user_id, agent_id, "assistant", flight.result)
+            logger.debug("Queued AI response: %d chars", len(flight.result))
+
+        stream.append(DONE_FRAME)
+    except Exception as e:
+        logger.error("Chat relay error: %s", e)
+        stream.append(error_frame(str(e)))
+        stream.append(DONE_FRAME)
+    finally:
+        # 取消时也要立即退订，否则上游调用要等生成器被回收才知道没有订阅者了
+        await frames.aclose()
+
+
+async def _replay_answer(stream: BroadcastStream, user_id: int, agent_id: int, answer: str):
+    """按设定节奏回放缓存的回答，并保存为AI回复"""
+    try:
+        async for chunk in replay_chunks(answer):
+            stream.append(content_frame(chunk))
+        await message_writer.submit(user_id, agent_id, "assistant", answer)
+        stream.append(DONE_FRAME)
+    except Exception as e:
+        logger.error("Cached answer replay error: %s", e)
+        stream.append(error_frame(str(e)))
+        stream.append(DONE_FRAME)
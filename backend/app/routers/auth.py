@@ -1,34 +1,47 @@
+import logging
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from ..database import get_db
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_async_db
 from ..models import User
 from ..schemas import UserRegister, UserLogin, UserResponse, TokenResponse, RegisterResponse
-from ..utils import hash_password, verify_password
-from ..auth import create_token, get_current_user
+from ..utils import password_hasher, password_needs_rehash
+from ..auth import UserSnapshot, create_token, get_current_user
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/auth", tags=["认证"])
 
 
 @router.post("/register", response_model=RegisterResponse)
-def register(data: UserRegister, db: Session = Depends(get_db)):
+async def register(data: UserRegister, db: AsyncSession = Depends(get_async_db)):
     """用户注册"""
     # 检查手机号是否已存在
-    existing = db.query(User).filter(User.phone == data.phone).first()
+    existing = (await db.execute(select(User.id).where(User.phone == data.phone))).first()
     if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="该手机号已注册"
         )
 
-    # 创建用户
+    # 创建用户（bcrypt 在独立进程池中计算）
     user = User(
         phone=data.phone,
-        password_hash=hash_password(data.password),
+        password_hash=await password_hasher.hash(data.password),
         tier="guest"
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # 同一手机号的并发注册
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="该手机号已注册"
+        )
+    await db.refresh(user)
 
     return RegisterResponse(
         user_id=user.id,
@@ -38,11 +51,11 @@ def register(data: UserRegister, db: Session = Depends(get_db)):
 
 
 @router.post("/login", response_model=TokenResponse)
-def login(data: UserLogin, db: Session = Depends(get_db)):
+async def login(data: UserLogin, db: AsyncSession = Depends(get_async_db)):
     """用户登录"""
-    user = db.query(User).filter(User.phone == data.phone).first()
+    user = (await db.execute(select(User).where(User.phone == data.phone))).scalar_one_or_none()
 
-    if not user or not verify_password(data.password, user.password_hash):
+    if not user or not await password_hasher.verify(data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="手机号或密码错误"
@@ -55,15 +68,28 @@ def login(data: UserLogin, db: Session = Depends(get_db)):
         )
 
     token = create_token(user.id)
+    user_response = UserResponse.model_validate(user)
+
+    # 代价因子调整后，用本次登录的明文按新代价重新计算哈希
+    if password_needs_rehash(user.password_hash):
+        try:
+            user.password_hash = await password_hasher.hash(data.password)
+            await db.commit()
+        except HTTPException:
+            # 哈希进程池繁忙，下次登录再更新
+            pass
+        except Exception as e:
+            await db.rollback()
+            logger.warning("Password rehash failed for user %s: %s", user_response.id, e)
 
     return TokenResponse(
         access_token=token,
         token_type="bearer",
-        user=UserResponse.model_validate(user)
+        user=user_response
     )
 
 
 @router.get("/me", response_model=UserResponse)
-def get_me(current_user: User = Depends(get_current_user)):
+def get_me(current_user: UserSnapshot = Depends(get_current_user)):
     """获取当前用户信息"""
     return UserResponse.model_validate(current_user)
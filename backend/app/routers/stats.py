@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from datetime import datetime
-from ..database import get_db
+from ..database import get_async_db
 from ..auth import get_current_user
 
 router = APIRouter(prefix="/api/stats", tags=["stats"])
@@ -10,46 +10,46 @@ router = APIRouter(prefix="/api/stats", tags=["stats"])
 @router.get("/user")
 async def get_user_stats(
     current_user = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取用户价值统计数据"""
 
-    # 统计总对话次数（用户发送的消息数）
-    total_result = db.execute(
-        text("SELECT COUNT(*) FROM chat_messages WHERE user_id = :user_id AND role = 'user'"),
+    # 使用次数来自 user_agent_usage 汇总表，每个用户最多与智能体数量相同的几行
+    total_result = (await db.execute(
+        text("SELECT COALESCE(SUM(message_count), 0) FROM user_agent_usage WHERE user_id = :user_id"),
         {"user_id": current_user.id}
-    ).fetchone()
+    )).fetchone()
     total_conversations = total_result[0] if total_result else 0
 
     # 计算使用天数
     days_since_register = (datetime.now() - current_user.created_at).days + 1
 
     # 最常用的智能体
-    most_used = db.execute(
+    most_used = (await db.execute(
         text("""
-            SELECT a.name, a.icon, COUNT(*) as count
-            FROM chat_messages cm
-            JOIN agents a ON cm.agent_id = a.id
-            WHERE cm.user_id = :user_id AND cm.role = 'user'
-            GROUP BY cm.agent_id
-            ORDER BY count DESC
+            SELECT a.name, a.icon, u.message_count
+            FROM user_agent_usage u
+            JOIN agents a ON u.agent_id = a.id
+            WHERE u.user_id = :user_id AND u.message_count > 0
+            ORDER BY u.message_count DESC
             LIMIT 1
         """),
         {"user_id": current_user.id}
-    ).fetchone()
+    )).fetchone()
 
     # 推荐未使用或少用的智能体
-    recommended = db.execute(
+    recommended = (await db.execute(
         text("""
             SELECT id, name, icon, description FROM agents
             WHERE status = 'active'
-            AND id NOT IN (
-                SELECT DISTINCT agent_id FROM chat_messages WHERE user_id = :user_id
+            AND NOT EXISTS (
+                SELECT 1 FROM user_agent_usage u
+                WHERE u.user_id = :user_id AND u.agent_id = agents.id
             )
             LIMIT 1
         """),
         {"user_id": current_user.id}
-    ).fetchone()
+    )).fetchone()
 
     # 计算价值
     cost_per_conversation = 15  # 每次对话节省15元人工成本
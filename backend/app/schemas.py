@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Tuple
 
 
 # ============ Auth Schemas ============
@@ -54,10 +54,16 @@ class AgentCreate(AgentBase):
     api_endpoint: str
     api_token: str
     project_id: str
+    rate_limit: Optional[float] = None
+    rate_burst: Optional[int] = None
+    max_in_flight: Optional[int] = None
+    queue_depth: Optional[int] = None
     tier_required: str = "365"
     status: str = "active"
     sort_order: int = 0
     quick_prompts: str = "[]"
+    answer_cache: bool = False
+    stateless: bool = False
 
 
 class AgentUpdate(BaseModel):
@@ -68,10 +74,16 @@ class AgentUpdate(BaseModel):
     api_endpoint: Optional[str] = None
     api_token: Optional[str] = None
     project_id: Optional[str] = None
+    rate_limit: Optional[float] = None
+    rate_burst: Optional[int] = None
+    max_in_flight: Optional[int] = None
+    queue_depth: Optional[int] = None
     tier_required: Optional[str] = None
     status: Optional[str] = None
     sort_order: Optional[int] = None
     quick_prompts: Optional[str] = None
+    answer_cache: Optional[bool] = None
+    stateless: Optional[bool] = None
 
 
 class AgentResponse(BaseModel):
@@ -100,12 +112,20 @@ class AgentAdminResponse(BaseModel):
     api_endpoint: str
     api_token: str
     project_id: str
+    rate_limit: Optional[float] = None
+    rate_burst: Optional[int] = None
+    max_in_flight: Optional[int] = None
+    queue_depth: Optional[int] = None
     tier_required: str
     status: str
     sort_order: int
     quick_prompts: str = "[]"
+    answer_cache: Optional[bool] = False
+    stateless: Optional[bool] = False
     created_at: datetime
 
+    circuit_state: str = "closed"  # 上游熔断状态：closed / open / half_open
+
     class Config:
         from_attributes = True
 
@@ -114,6 +134,8 @@ class AgentAdminResponse(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str
+    # 客户端为每条消息生成的唯一键，断线重发时携带同一个键即可续传，不会重复调用
+    idempotency_key: Optional[str] = Field(None, max_length=64)
 
 
 class ChatMessageResponse(BaseModel):
@@ -127,7 +149,24 @@ class ChatMessageResponse(BaseModel):
 
 
 class ChatHistoryResponse(BaseModel):
-    messages: List[ChatMessageResponse]
+    messages: List[ChatMessageResponse]  # 按时间正序
+    has_more: bool = False  # 是否还有更早的消息
+    next_before_id: Optional[int] = None  # 加载更早消息时传入的 before_id
+
+
+class ChatSearchHit(BaseModel):
+    id: int
+    agent_id: int
+    role: str
+    snippet: str  # 命中位置附近的片段
+    highlights: List[Tuple[int, int]] = []  # snippet 中需要高亮的 [start, end) 区间
+    created_at: datetime
+
+
+class ChatSearchResponse(BaseModel):
+    results: List[ChatSearchHit]  # 按相关度（短词检索时按时间倒序）
+    has_more: bool = False
+    next_offset: Optional[int] = None  # 下一页传入的 offset
 
 
 # ============ Admin User Schemas ============
@@ -0,0 +1,110 @@
+"""
+快捷提问答案缓存（按智能体开启）
+
+快捷提问是管理员配置的固定问题，用户反复点击时每次都完整调用一次上游。
+开启缓存的智能体，快捷提问的完整回答按 (智能体, 规范化问题, 上游配置版本) 缓存，
+命中时不经过限流、并发隔离和上游调用，直接按设定的节奏以 SSE 帧回放。
+
+只缓存快捷提问：普通对话依赖 Coze 会话上下文，相同的文字不代表相同的问题。
+缓存命中的问答不进入该用户的 Coze 会话，只写入本地对话记录。
+"""
+import os
+import json
+import asyncio
+import hashlib
+import unicodedata
+from functools import lru_cache
+from typing import AsyncIterator, FrozenSet, Optional, Tuple
+from ..cache import TTLCache
+from ..catalog import AgentEntry
+from ..metrics import cache_collector, register_collector
+from ..state import publish, subscribe
+
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_MAXSIZE = int(os.getenv("ANSWER_CACHE_MAXSIZE", "500"))
+# 回放节奏：每帧字符数、帧间隔（毫秒）；间隔为 0 时一次性输出
+ANSWER_CACHE_REPLAY_CHARS = int(os.getenv("ANSWER_CACHE_REPLAY_CHARS", "24"))
+ANSWER_CACHE_REPLAY_INTERVAL = float(os.getenv("ANSWER_CACHE_REPLAY_INTERVAL_MS", "20")) / 1000
+
+
+def normalize_prompt(text: str) -> str:
+    """全角转半角、合并空白、忽略大小写"""
+    return " ".join(unicodedata.normalize("NFKC", text).split()).casefold()
+
+
+@lru_cache(maxsize=256)
+def _quick_prompt_set(raw: str) -> FrozenSet[str]:
+    try:
+        prompts = json.loads(raw or "[]")
+    except ValueError:
+        return frozenset()
+    if not isinstance(prompts, list):
+        return frozenset()
+    return frozenset(normalize_prompt(p) for p in prompts if isinstance(p, str) and p.strip())
+
+
+def config_version(agent: AgentEntry) -> str:
+    """上游配置摘要：修改 endpoint 或 project_id 后旧答案自动失效"""
+    return hashlib.sha1(f"{agent.api_endpoint}\n{agent.project_id}".encode()).hexdigest()[:12]
+
+
+class AnswerCache:
+    def __init__(self, maxsize: int = ANSWER_CACHE_MAXSIZE, ttl: float = ANSWER_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+        # 统计
+        self.stored = 0
+        self.purged = 0
+
+    def key(self, agent: AgentEntry, message: str) -> Optional[Tuple[int, str, str]]:
+        """智能体未开启缓存、或问题不是它的快捷提问时返回 None"""
+        if not agent.answer_cache:
+            return None
+        prompt = normalize_prompt(message)
+        if prompt not in _quick_prompt_set(agent.quick_prompts):
+            return None
+        return (agent.id, prompt, config_version(agent))
+
+    def get(self, key: Tuple[int, str, str]) -> Optional[str]:
+        return self._cache.get(key)
+
+    def set(self, key: Tuple[int, str, str], answer: str):
+        self._cache.set(key, answer)
+        self.stored += 1
+
+    def purge_local(self, agent_id: int) -> int:
+        removed = self._cache.remove_if(lambda key: key[0] == agent_id)
+        self.purged += removed
+        return removed
+
+    def purge(self, agent_id: int) -> int:
+        """清除该智能体的缓存答案，并通知其他 worker"""
+        removed = self.purge_local(agent_id)
+        publish("answer_cache", agent_id)
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            **self._cache.stats(),
+            "ttl": self._cache.ttl,
+            "stored": self.stored,
+            "purged": self.purged,
+        }
+
+
+async def replay_chunks(answer: str) -> AsyncIterator[str]:
+    """把缓存的回答切成小块，按设定的节奏产出，模拟流式输出"""
+    size = max(ANSWER_CACHE_REPLAY_CHARS, 1)
+    if ANSWER_CACHE_REPLAY_INTERVAL <= 0:
+        yield answer
+        return
+    for i in range(0, len(answer), size):
+        if i:
+            await asyncio.sleep(ANSWER_CACHE_REPLAY_INTERVAL)
+        yield answer[i:i + size]
+
+
+answer_cache = AnswerCache()
+
+subscribe("answer_cache", answer_cache.purge_local)
+register_collector(cache_collector("luna_answer_cache", lambda: {"answers": answer_cache._cache}))
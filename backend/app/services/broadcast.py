@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+from typing import AsyncIterator, Callable, Dict, Hashable, List, Optional, Set, Tuple
+from ..state import state_backend
+
+logger = logging.getLogger(__name__)
+
+# 对话结束后保留输出的时间（秒），期间断线的客户端仍可凭 Last-Event-ID 续传
+STREAM_RESUME_TTL = float(os.getenv("CHAT_STREAM_RESUME_TTL", "120"))
+# 多 worker 时进行中的流在共享状态中的最长登记时间（秒），worker 异常退出后键不会一直被占用
+STREAM_CLAIM_TTL = 600.0
+
+
+class BroadcastStream:
+    """
+    一次上游生成的输出缓冲
+
+    生成过程在独立任务中运行，产出的 SSE 帧按序号（从 0 开始）保存在内存中；
+    任意数量的订阅者可以从任意序号开始读取，读到末尾后等待新帧。
+    订阅者断开不影响生成；只有 cancel_when_idle 为真时，最后一个订阅者离开才取消生成。
+    """
+
+    def __init__(self, cancel_when_idle: bool = False):
+        self.cancel_when_idle = cancel_when_idle
+        self.frames: List[str] = []
+        self.closed = False
+        self.subscribers = 0
+        self.result = None  # 生成成功结束时由生成协程设置
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._close_callbacks: List[Callable[[], None]] = []
+
+    def start(self, coro):
+        """在后台任务中运行生成协程；协程结束（包括出错、被取消）时自动关闭"""
+        async def run():
+            try:
+                await coro
+            finally:
+                self.close()
+        self._task = asyncio.create_task(run())
+
+    def append(self, frame: str):
+        self.frames.append(frame)
+        self._notify()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._notify()
+        for callback in self._close_callbacks:
+            callback()
+
+    def add_close_callback(self, callback: Callable[[], None]):
+        if self.closed:
+            callback()
+        else:
+            self._close_callbacks.append(callback)
+
+    def _notify(self):
+        # 唤醒当前所有等待者，之后的等待使用新的 Event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self, start: int = 0) -> AsyncIterator[Tuple[int, str]]:
+        """依次产出 (序号, 帧)，从 start 开始，直到生成结束"""
+        self.subscribers += 1
+        try:
+            position = max(start, 0)
+            while True:
+                while position < len(self.frames):
+                    yield position, self.frames[position]
+                    position += 1
+                if self.closed:
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and self.cancel_when_idle and self._task is not None and not self.closed:
+                self._task.cancel()
+
+
+class StreamRegistry:
+    """
+    按键登记进行中（及刚结束）的输出流，结束 ttl 秒后移除
+
+    流本身只在创建它的 worker 内存中。传入 shared_prefix 且共享状态后端为多 worker 时，
+    键同时登记在共享状态中：其他 worker 收到同一个键的请求时通过 claim() 得知它已在别处处理，
+    不会再次保存消息、调用上游。
+    """
+
+    def __init__(self, ttl: float = STREAM_RESUME_TTL, shared_prefix: Optional[str] = None):
+        self.ttl = ttl
+        self.shared_prefix = shared_prefix if state_backend.shared else None
+        self._streams: Dict[Hashable, BroadcastStream] = {}
+        # 共享状态的写入在线程中执行（SQLite 可能等待锁），后台任务的引用保存在这里
+        self._tasks: Set[asyncio.Task] = set()
+
+        # 统计
+        self.created = 0
+        self.attached = 0
+        self.conflicts = 0
+
+    def get(self, key: Hashable) -> Optional[BroadcastStream]:
+        return self._streams.get(key)
+
+    def add(self, key: Hashable, stream: BroadcastStream):
+        self._streams[key] = stream
+        self.created += 1
+        loop = asyncio.get_running_loop()
+
+        def on_close():
+            if self._streams.get(key) is stream:
+                self._spawn(self._set_shared(key, "done", self.ttl))
+            loop.call_later(self.ttl, self.discard, key, stream)
+        stream.add_close_callback(on_close)
+
+    def discard(self, key: Hashable, stream: BroadcastStream):
+        """移除该流；共享登记在后台任务中释放，不阻塞调用方"""
+        # 同一个键可能已被新的流替换
+        if self._streams.get(key) is stream:
+            del self._streams[key]
+            self._spawn(self._delete_shared(key))
+
+    def _spawn(self, coro):
+        if self.shared_prefix is None:
+            coro.close()
+            return
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # ---- 多 worker 共享登记 ----
+
+    def _shared_key(self, key: Hashable) -> str:
+        return f"{self.shared_prefix}:{json.dumps(key, ensure_ascii=False)}"
+
+    async def claim(self, key: Hashable) -> Optional[str]:
+        """
+        在共享状态中占用该键（登记为进行中）
+
+        键已被其他 worker 占用时返回其状态（"active" 进行中 / "done" 已结束），
+        占用成功、单进程部署或共享状态不可用时返回 None。
+        """
+        if self.shared_prefix is None:
+            return None
+        now = time.time()
+        pid = os.getpid()
+
+        def update(entry):
+            if entry and entry["pid"] != pid and entry["expires"] > now:
+                return entry, entry["state"]
+            return {"pid": pid, "state": "active", "expires": now + STREAM_CLAIM_TTL}, None
+
+        try:
+            state = await asyncio.to_thread(state_backend.update, self._shared_key(key), update)
+        except sqlite3.Error as e:
+            logger.error("Failed to claim stream key: %s", e)
+            return None
+        if state is not None:
+            self.conflicts += 1
+        return state
+
+    async def release(self, key: Hashable):
+        """claim() 之后没能登记流（如限流、并发已满）时释放占用"""
+        if key not in self._streams:
+            await self._delete_shared(key)
+
+    async def _set_shared(self, key: Hashable, state: str, ttl: float):
+        if self.shared_prefix is None:
+            return
+        entry = {"pid": os.getpid(), "state": state, "expires": time.time() + ttl}
+        try:
+            await asyncio.to_thread(state_backend.update, self._shared_key(key), lambda _: (entry, None))
+        except sqlite3.Error as e:
+            logger.error("Failed to update stream key: %s", e)
+
+    async def _delete_shared(self, key: Hashable):
+        if self.shared_prefix is None:
+            return
+        try:
+            await asyncio.to_thread(state_backend.delete, self._shared_key(key))
+        except sqlite3.Error as e:
+            logger.error("Failed to release stream key: %s", e)
+
+    def stats(self) -> dict:
+        active = sum(1 for stream in self._streams.values() if not stream.closed)
+        return {
+            "active": active,
+            "retained": len(self._streams) - active,
+            "created": self.created,
+            "attached": self.attached,
+            "conflicts": self.conflicts,
+        }
@@ -0,0 +1,193 @@
+import os
+import heapq
+import asyncio
+import itertools
+from typing import AsyncIterator, Dict, List, Optional
+from fastapi import HTTPException, status
+
+# 智能体未单独配置时的默认并发上限与排队长度
+DEFAULT_MAX_IN_FLIGHT = int(os.getenv("AGENT_MAX_IN_FLIGHT", "20"))
+DEFAULT_QUEUE_DEPTH = int(os.getenv("AGENT_QUEUE_DEPTH", "50"))
+
+# 排队优先级：数值越小越先放行，同优先级按到达顺序
+TIER_PRIORITY = {"3980": 0, "365": 1}
+LOWEST_PRIORITY = 2
+
+
+def tier_priority(tier: str) -> int:
+    return TIER_PRIORITY.get(tier, LOWEST_PRIORITY)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "updates", "granted", "cancelled", "position", "enqueued_at")
+
+    def __init__(self, priority: int, seq: int, enqueued_at: float):
+        self.priority = priority
+        self.seq = seq
+        self.updates: asyncio.Queue = asyncio.Queue()  # 排队位置变化，0 表示已放行
+        self.granted = False
+        self.cancelled = False
+        self.position = 0
+        self.enqueued_at = enqueued_at
+
+
+class Ticket:
+    """一次调用的占位凭证：wait() 期间输出排队位置，结束后必须 release()"""
+
+    def __init__(self, bulkhead: "Bulkhead", waiter: Optional[_Waiter] = None):
+        self._bulkhead = bulkhead
+        self._waiter = waiter
+        self._released = False
+
+    async def wait(self) -> AsyncIterator[int]:
+        """排队等待放行，每当位置变化时产出当前位置（从 1 开始）"""
+        waiter = self._waiter
+        if waiter is None:
+            return
+        while True:
+            position = await waiter.updates.get()
+            # 只关心最新位置
+            while not waiter.updates.empty():
+                position = waiter.updates.get_nowait()
+            if position == 0:
+                return
+            yield position
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        waiter = self._waiter
+        if waiter is None or waiter.granted:
+            self._bulkhead._finish()
+        else:
+            self._bulkhead._cancel(waiter)
+
+
+class Bulkhead:
+    """单个智能体的隔舱：限制同时进行的上游调用数，超出部分按优先级排队"""
+
+    def __init__(self, max_in_flight: int, queue_depth: int):
+        self.max_in_flight = max_in_flight
+        self.queue_depth = queue_depth
+        self.in_flight = 0
+        self._heap: List[tuple] = []
+        self._queued = 0
+        self._seq = itertools.count()
+
+        # 统计
+        self.admitted = 0
+        self.rejected = 0
+        self.queued_total = 0
+        self.dequeued = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def configure(self, max_in_flight: int, queue_depth: int):
+        self.max_in_flight = max_in_flight
+        self.queue_depth = queue_depth
+        # 上限调大后立即放行排队中的请求
+        self._dispatch()
+
+    def check(self):
+        """并发名额和排队都已满时抛出 503（在开始流式响应前调用，返回真实状态码）"""
+        if self.in_flight >= self.max_in_flight and self._queued >= self.queue_depth:
+            self._reject()
+
+    def _reject(self):
+        self.rejected += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="当前使用人数过多，请稍后再试"
+        )
+
+    def enter(self, priority: int) -> Ticket:
+        """占用一个调用名额；名额已满时排队，排队也满时抛出 503"""
+        if self.in_flight < self.max_in_flight and self._queued == 0:
+            self.in_flight += 1
+            self.admitted += 1
+            return Ticket(self)
+
+        if self._queued >= self.queue_depth:
+            self._reject()
+
+        waiter = _Waiter(priority, next(self._seq), asyncio.get_running_loop().time())
+        heapq.heappush(self._heap, (waiter.priority, waiter.seq, waiter))
+        self._queued += 1
+        self.queued_total += 1
+        self._update_positions()
+        return Ticket(self, waiter)
+
+    def _finish(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _cancel(self, waiter: _Waiter):
+        # 标记后由 _update_positions / _dispatch 移出堆
+        waiter.cancelled = True
+        self._queued -= 1
+        self._update_positions()
+
+    def _dispatch(self):
+        dispatched = False
+        while self._heap and self.in_flight < self.max_in_flight:
+            _, _, waiter = heapq.heappop(self._heap)
+            if waiter.cancelled:
+                continue
+            waiter.granted = True
+            self._queued -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            self.dequeued += 1
+            waited = asyncio.get_running_loop().time() - waiter.enqueued_at
+            self.queue_wait_total += waited
+            self.queue_wait_max = max(self.queue_wait_max, waited)
+            waiter.updates.put_nowait(0)
+            dispatched = True
+        if dispatched:
+            self._update_positions()
+
+    def _update_positions(self):
+        """排队长度受 queue_depth 限制，每次变化时直接重排并通知位置有变的等待者"""
+        live = sorted(entry for entry in self._heap if not entry[2].cancelled)
+        self._heap = live  # 有序列表本身就是合法的堆，顺便清理已取消的条目
+        for position, (_, _, waiter) in enumerate(live, 1):
+            if waiter.position != position:
+                waiter.position = position
+                waiter.updates.put_nowait(position)
+
+    def stats(self) -> dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "queued": self._queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_queue_wait_ms": round(self.queue_wait_total / self.dequeued * 1000, 1) if self.dequeued else 0.0,
+            "max_queue_wait_ms": round(self.queue_wait_max * 1000, 1),
+        }
+
+
+class BulkheadRegistry:
+    """按智能体ID维护隔舱"""
+
+    def __init__(self):
+        self._bulkheads: Dict[int, Bulkhead] = {}
+
+    def get(self, agent) -> Bulkhead:
+        max_in_flight = agent.max_in_flight if agent.max_in_flight and agent.max_in_flight > 0 else DEFAULT_MAX_IN_FLIGHT
+        queue_depth = agent.queue_depth if agent.queue_depth is not None and agent.queue_depth >= 0 else DEFAULT_QUEUE_DEPTH
+        bulkhead = self._bulkheads.get(agent.id)
+        if bulkhead is None:
+            bulkhead = self._bulkheads[agent.id] = Bulkhead(max_in_flight, queue_depth)
+        elif bulkhead.max_in_flight != max_in_flight or bulkhead.queue_depth != queue_depth:
+            # 管理员修改了配置
+            bulkhead.configure(max_in_flight, queue_depth)
+        return bulkhead
+
+    def stats(self) -> dict:
+        return {agent_id: bulkhead.stats() for agent_id, bulkhead in self._bulkheads.items()}
+
+
+bulkheads = BulkheadRegistry()
@@ -0,0 +1,183 @@
+import os
+import time
+import random
+import logging
+from collections import deque
+from typing import Deque, Dict, Tuple
+from fastapi import HTTPException, status
+
+logger = logging.getLogger(__name__)
+
+# 滚动窗口（秒）内至少有 MIN_CALLS 次调用且错误率达到阈值时熔断
+CIRCUIT_WINDOW = float(os.getenv("CIRCUIT_WINDOW", "30"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))
+# 熔断时长：首次 OPEN_SECONDS，半开探测失败后指数增长，不超过 MAX_OPEN_SECONDS
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "5"))
+CIRCUIT_MAX_OPEN_SECONDS = float(os.getenv("CIRCUIT_MAX_OPEN_SECONDS", "60"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """带抖动的指数退避：在 [cap/2, cap] 之间随机，cap = min(base * 2^(attempt-1), 上限)"""
+    ceiling = min(base * (2 ** (attempt - 1)), cap)
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+class BreakerPermit:
+    """acquire() 放行时发出的凭证：记录放行时的状态代数，以及是否为半开探测"""
+
+    __slots__ = ("generation", "probe")
+
+    def __init__(self, generation: int, probe: bool):
+        self.generation = generation
+        self.probe = probe
+
+
+class CircuitBreaker:
+    """
+    单个 Coze 端点（api_endpoint + project_id）的熔断器
+
+    - closed：正常放行，记录滚动窗口内的成功/失败
+    - open：直接拒绝，到期后进入 half_open
+    - half_open：只放行一个探测请求，成功则恢复 closed，失败则以更长的时长重新 open
+
+    每次状态切换代数加一。调用结果凭 acquire() 返回的凭证上报，放行之后状态已经切换过的
+    调用（例如熔断前发出、半开时才结束的慢请求）结果被忽略，不会占用或释放探测名额。
+    """
+
+    def __init__(self):
+        self.state = CLOSED
+        self._window: Deque[Tuple[float, bool]] = deque()
+        self._failures = 0
+        self._open_until = 0.0
+        self._trips = 0  # 连续熔断次数，决定下一次熔断时长
+        self._probing = False
+        self._generation = 0
+
+        # 统计
+        self.rejected = 0
+        self.opened = 0
+
+    def _prune(self, now: float):
+        window = self._window
+        while window and window[0][0] < now - CIRCUIT_WINDOW:
+            _, ok = window.popleft()
+            if not ok:
+                self._failures -= 1
+
+    def _transition(self, state: str):
+        self.state = state
+        self._generation += 1
+        self._probing = False
+
+    def _current(self, permit: BreakerPermit) -> bool:
+        return permit.generation == self._generation
+
+    def _trip(self, now: float):
+        self._trips += 1
+        self.opened += 1
+        duration = backoff_delay(self._trips, CIRCUIT_OPEN_SECONDS, CIRCUIT_MAX_OPEN_SECONDS)
+        self._transition(OPEN)
+        self._open_until = now + duration
+        logger.warning("Circuit opened for %.1fs", duration)
+
+    def is_open(self) -> bool:
+        return self.state == OPEN and time.monotonic() < self._open_until
+
+    def acquire(self) -> BreakerPermit:
+        """调用前检查，返回本次调用的凭证；熔断中抛出 503"""
+        now = time.monotonic()
+        if self.state == OPEN:
+            if now < self._open_until:
+                self._reject()
+            # 熔断到期，放行一个探测请求
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probing:
+                self._reject()
+            self._probing = True
+            return BreakerPermit(self._generation, probe=True)
+        return BreakerPermit(self._generation, probe=False)
+
+    def release(self, permit: BreakerPermit):
+        """调用结束（包括客户端中途断开等没有结论的情况），只有探测请求本身才释放探测名额"""
+        if permit.probe and self._current(permit):
+            self._probing = False
+
+    def _reject(self):
+        self.rejected += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="智能体服务暂时不可用，请稍后再试"
+        )
+
+    def record_success(self, permit: BreakerPermit):
+        if not self._current(permit):
+            return
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            logger.info("Circuit closed after successful probe")
+            self._transition(CLOSED)
+            self._trips = 0
+            self._window.clear()
+            self._failures = 0
+        self._window.append((now, True))
+        self._prune(now)
+
+    def record_failure(self, permit: BreakerPermit):
+        if not self._current(permit):
+            return
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            self._trip(now)
+            return
+        self._window.append((now, False))
+        self._failures += 1
+        self._prune(now)
+        if self.state == CLOSED:
+            calls = len(self._window)
+            if calls >= CIRCUIT_MIN_CALLS and self._failures / calls >= CIRCUIT_ERROR_RATE:
+                self._trip(now)
+
+    def current_state(self) -> str:
+        """对外展示的状态（open 已到期视为 half_open）"""
+        if self.state == OPEN and time.monotonic() >= self._open_until:
+            return HALF_OPEN
+        return self.state
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        self._prune(now)
+        calls = len(self._window)
+        return {
+            "state": self.current_state(),
+            "window_calls": calls,
+            "error_rate": round(self._failures / calls, 4) if calls else 0.0,
+            "open_remaining": round(max(self._open_until - now, 0.0), 1) if self.state == OPEN else 0.0,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+
+def get_breaker(api_endpoint: str, project_id: str) -> CircuitBreaker:
+    key = (api_endpoint, str(project_id))
+    breaker = _breakers.get(key)
+    if breaker is None:
+        breaker = _breakers[key] = CircuitBreaker()
+    return breaker
+
+
+def breaker_state(api_endpoint: str, project_id: str) -> str:
+    breaker = _breakers.get((api_endpoint, str(project_id)))
+    return breaker.current_state() if breaker is not None else CLOSED
+
+
+def breaker_stats() -> dict:
+    return {f"{endpoint}#{project_id}": breaker.stats() for (endpoint, project_id), breaker in _breakers.items()}
@@ -1,69 +1,41 @@
-import os
 import httpx
-import json
 import logging
 import warnings
-import uuid
 import asyncio
-import time
 from typing import AsyncGenerator, Optional
 from fastapi import HTTPException
+from ..logging_config import log_sampled
+from ..metrics import upstream_retries, upstream_timeouts
+from .coze_sse import END_TYPES, decode_messages, end_error, extract_text, iter_sse_events
+from .http_pool import SSL_VERIFY, STALE_CONNECTION_ERRORS, AttemptTrace, get_pool
+from .circuit_breaker import BreakerPermit, CircuitBreaker, backoff_delay, get_breaker
+from .session_store import session_key, session_store
 
 # 配置日志
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# SSL验证配置
-# 生产环境应设置 COZE_SSL_VERIFY=true
-# 开发环境如果Coze API有证书问题，可以设置为 false
-SSL_VERIFY = os.getenv("COZE_SSL_VERIFY", "false").lower() == "true"
-
 if not SSL_VERIFY:
     # 仅在禁用SSL验证时才禁用警告
     warnings.filterwarnings("ignore", message="Unverified HTTPS request")
     logger.warning("SSL verification is DISABLED for Coze API. Set COZE_SSL_VERIFY=true in production.")
 
-# 会话管理：为每个 project_id + user_id 维护一个 session_id
-_session_cache: dict[str, str] = {}
-
-# 全局 httpx 客户端，避免每次请求创建新连接
-_http_client: Optional[httpx.AsyncClient] = None
+DRAIN_TIMEOUT = 2.0  # 收到结束标志后等待响应体结束的最长时间（秒）
+RETRY_MAX_DELAY = 8.0  # 重试退避上限（秒）
 
-# 请求时间记录，用于速率限制
-_last_request_time: dict[str, float] = {}
-MIN_REQUEST_INTERVAL = 0.5  # 同一个 project_id 最小请求间隔（秒）
 
+async def get_or_create_session_id(project_id: str, user_id: Optional[int] = None) -> str:
+    """获取或创建会话ID，避免Coze后端创建过多新连接（为每个 project_id + user_id 维护一个）"""
+    return await session_store.get_or_create(session_key(project_id, user_id))
 
-async def get_http_client() -> httpx.AsyncClient:
-    """获取或创建共享的 HTTP 客户端"""
-    global _http_client
-    if _http_client is None or _http_client.is_closed:
-        _http_client = httpx.AsyncClient(
-            verify=SSL_VERIFY,
-            timeout=httpx.Timeout(120.0, connect=10.0, read=120.0),
-            limits=httpx.Limits(
-                max_keepalive_connections=20,
-                max_connections=50,
-                keepalive_expiry=60.0
-            ),
-            http2=False  # 禁用 HTTP/2，避免连接复用问题
-        )
-    return _http_client
 
-
-def get_or_create_session_id(project_id: str, user_id: Optional[int] = None) -> str:
-    """获取或创建会话ID，避免Coze后端创建过多新连接"""
-    cache_key = f"{project_id}:{user_id or 'default'}"
-    if cache_key not in _session_cache:
-        _session_cache[cache_key] = str(uuid.uuid4())
-    return _session_cache[cache_key]
+async def clear_session(project_id: str, user_id: Optional[int] = None):
+    """清除会话（用于重置对话）"""
+    await session_store.clear(session_key(project_id, user_id))
 
 
-def clear_session(project_id: str, user_id: Optional[int] = None):
-    """清除会话（用于重置对话）"""
-    cache_key = f"{project_id}:{user_id or 'default'}"
-    if cache_key in _session_cache:
-        del _session_cache[cache_key]
+async def _drain(events):
+    async for _ in events:
+        pass
 
 
 async def call_coze_agent(
@@ -82,8 +54,32 @@ async def call_coze_agent(
     2. 添加完整的请求头，模拟浏览器行为
     3. 确保流完全消费，避免连接泄露
     4. 添加优雅关闭机制
+    5. 复用按 host 共享的连接池，避免每次请求重新握手
+    6. 按端点熔断：上游持续出错时直接返回 503，不再让每个请求都重试等待
     """
-    session_id = get_or_create_session_id(project_id, user_id)
+    breaker = get_breaker(api_endpoint, project_id)
+    permit = breaker.acquire()
+    stream = _stream_coze_agent(api_endpoint, api_token, project_id, message, user_id, timeout, breaker, permit)
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        breaker.release(permit)
+        await stream.aclose()
+
+
+async def _stream_coze_agent(
+    api_endpoint: str,
+    api_token: str,
+    project_id: str,
+    message: str,
+    user_id: Optional[int],
+    timeout: float,
+    breaker: CircuitBreaker,
+    permit: BreakerPermit
+) -> AsyncGenerator[str, None]:
+    """单次调用的请求、解析与重试，每次尝试的结果计入熔断器"""
+    session_id = await get_or_create_session_id(project_id, user_id)
 
     headers = {
         "Authorization": f"Bearer {api_token}",
@@ -106,133 +102,132 @@ async def call_coze_agent(
         "project_id": int(project_id),
     }
 
-    logger.info(f"Calling Coze API: {api_endpoint}")
-    logger.info(f"Project ID: {project_id}, Session ID: {session_id}")
-
-    # 速率限制：避免对同一个 project_id 发送过快的请求
-    current_time = time.time()
-    last_time = _last_request_time.get(project_id, 0)
-    time_since_last = current_time - last_time
-    if time_since_last < MIN_REQUEST_INTERVAL:
-        wait_time = MIN_REQUEST_INTERVAL - time_since_last
-        logger.info(f"Rate limiting: waiting {wait_time:.2f}s")
-        await asyncio.sleep(wait_time)
-    _last_request_time[project_id] = time.time()
+    logger.debug("Calling Coze API: %s project=%s session=%s", api_endpoint, project_id, session_id)
 
+    pool = get_pool(api_endpoint)
     max_retries = 3
     retry_delay = 1.0
+    attempt = 0
+    stale_retried = False
 
-    for attempt in range(max_retries):
+    while True:
+        received = False
+        trace = AttemptTrace()
         try:
-            # 每次请求创建新客户端，避免复用可能已失效的连接
-            async with httpx.AsyncClient(
-                verify=SSL_VERIFY,
-                timeout=httpx.Timeout(timeout, connect=10.0, read=timeout),
-                http2=False
-            ) as client:
-                async with client.stream(
-                    "POST",
-                    api_endpoint,
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    logger.info(f"Response status: {response.status_code}")
-
-                    if response.status_code != 200:
-                        error_text = await response.aread()
-                        error_msg = error_text.decode()
-                        logger.error(f"API error response: {error_msg}")
-
-                        # 如果是500错误，清除session
-                        if response.status_code == 500:
-                            clear_session(project_id, user_id)
-
-                        raise HTTPException(
-                            status_code=response.status_code,
-                            detail=f"Coze API错误: {error_msg[:200]}"
-                        )
-
-                    async for line in response.aiter_lines():
-                        if not line or not line.startswith("data:"):
-                            continue
-
-                        data_str = line[5:].strip()
-                        if not data_str:
-                            continue
-
-                        try:
-                            data = json.loads(data_str)
-                            msg_type = data.get("type", "")
-                            content = data.get("content", {})
-
-                            chunk = None
-
-                            # 提取文本内容
-                            if msg_type == "answer":
-                                content_obj = data.get("content", {})
-                                chunk = content_obj.get("answer", "")
-                            elif msg_type in ["message_start", "message", "content_block_delta", "delta"]:
-                                content_obj = data.get("content", {})
-                                chunk = (
-                                    content_obj.get("answer") or
-                                    content_obj.get("text") or
-                                    content_obj.get("message") or
-                                    content_obj.get("delta", {}).get("text") or
-                                    data.get("answer") or
-                                    data.get("text") or
-                                    data.get("delta", {}).get("text") or
-                                    ""
-                                )
-                            else:
-                                chunk = (
-                                    data.get("answer") or
-                                    data.get("text") or
-                                    data.get("message") or
-                                    (data.get("content") if isinstance(data.get("content"), str) else None) or
-                                    ""
-                                )
-
-                            if chunk:
-                                yield chunk
-
-                            # 检查结束标志
-                            if msg_type in ["message_end", "done", "stop"]:
-                                logger.info(f"Received end signal: {msg_type}")
-                                # 检查是否有错误
-                                if isinstance(content, dict):
-                                    msg_end = content.get("message_end", {})
-                                    if isinstance(msg_end, dict) and msg_end.get("code") == "500":
-                                        error_msg = msg_end.get("message", "Coze服务内部错误")
-                                        logger.error(f"Coze returned 500 error: {error_msg}")
-                                        clear_session(project_id, user_id)
-                                        raise HTTPException(status_code=502, detail=f"智能体服务暂时不可用: {error_msg[:100]}")
-                                break
-
-                        except json.JSONDecodeError as e:
-                            logger.warning(f"JSON decode error: {e}")
-                            continue
-
-            logger.info("Coze API call completed successfully")
+            async with pool.stream(
+                "POST",
+                api_endpoint,
+                headers=headers,
+                json=payload,
+                timeout=timeout,
+                attempt=trace
+            ) as response:
+                logger.debug("Response status: %s", response.status_code)
+
+                if response.status_code != 200:
+                    error_text = await response.aread()
+                    error_msg = error_text.decode()
+                    logger.error("Coze API error response %s: %s", response.status_code, error_msg[:500])
+
+                    # 服务端错误和限流计入熔断统计，其他 4xx 属于配置或请求问题
+                    if response.status_code >= 500 or response.status_code == 429:
+                        breaker.record_failure(permit)
+
+                    # 如果是500错误，清除session
+                    if response.status_code == 500:
+                        await clear_session(project_id, user_id)
+
+                    raise HTTPException(
+                        status_code=response.status_code,
+                        detail=f"Coze API错误: {error_msg[:200]}"
+                    )
+
+                events = iter_sse_events(response.aiter_lines())
+                ended = False
+                async for event in events:
+                    try:
+                        messages = decode_messages(event)
+                    except ValueError as e:
+                        log_sampled(logger, logging.WARNING, "coze_sse_decode", "Coze SSE decode error: %s", e)
+                        continue
+
+                    for data in messages:
+                        # 提取文本内容
+                        chunk = extract_text(data)
+                        if chunk:
+                            received = True
+                            yield chunk
+
+                        # 检查结束标志
+                        msg_type = data.get("type", "")
+                        if msg_type in END_TYPES:
+                            logger.debug("Received end signal: %s", msg_type)
+                            # 检查是否有错误
+                            error_msg = end_error(data)
+                            if error_msg is not None:
+                                logger.error("Coze returned error at end of stream: %s", error_msg)
+                                breaker.record_failure(permit)
+                                await clear_session(project_id, user_id)
+                                raise HTTPException(status_code=502, detail=f"智能体服务暂时不可用: {error_msg[:100]}")
+                            ended = True
+                            break
+
+                    if ended:
+                        break
+
+                # 读完剩余响应体，连接才能归还连接池复用；对端迟迟不关闭则放弃该连接
+                if ended:
+                    try:
+                        await asyncio.wait_for(_drain(events), DRAIN_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        pass
+
+            breaker.record_success(permit)
+            logger.info("Coze API call completed (project=%s)", project_id)
             return  # 成功完成，退出重试循环
 
-        except (httpx.ConnectError, httpx.RemoteProtocolError) as e:
-            logger.warning(f"Connection error (attempt {attempt + 1}/{max_retries}): {type(e).__name__}: {e}")
+        except (httpx.ConnectError, *STALE_CONNECTION_ERRORS) as e:
+            # 已经向前端输出过内容，重试会导致重复输出
+            if received:
+                logger.error("Stream interrupted: %s: %s", type(e).__name__, e)
+                breaker.record_failure(permit)
+                await clear_session(project_id, user_id)
+                raise HTTPException(status_code=502, detail="智能体连接中断")
+
+            # 池中的空闲连接可能已被对端关闭，立即在新连接上透明重试一次；
+            # 新建的连接、或请求已完整写出时上游可能已受理，走正常的计数重试
+            if isinstance(e, STALE_CONNECTION_ERRORS) and trace.stale and not stale_retried:
+                stale_retried = True
+                pool.stale_retries += 1
+                upstream_retries.inc("stale_connection")
+                logger.info("Stale pooled connection, retrying: %s", type(e).__name__)
+                continue
+
+            attempt += 1
+            breaker.record_failure(permit)
+            logger.warning("Connection error (attempt %d/%d): %s: %s", attempt, max_retries, type(e).__name__, e)
 
-            if attempt < max_retries - 1:
-                await asyncio.sleep(retry_delay * (attempt + 1))
+            # 熔断后不再重试，避免放大上游压力
+            if attempt < max_retries and not breaker.is_open():
+                upstream_retries.inc("connect_error")
+                await asyncio.sleep(backoff_delay(attempt, retry_delay, RETRY_MAX_DELAY))
                 continue
             else:
-                clear_session(project_id, user_id)
+                await clear_session(project_id, user_id)
                 raise HTTPException(status_code=502, detail="无法连接智能体服务")
 
         except httpx.TimeoutException as e:
-            logger.error(f"Timeout error: {e}")
-            clear_session(project_id, user_id)
+            logger.error("Timeout error: %s", e)
+            upstream_timeouts.inc()
+            breaker.record_failure(permit)
+            await clear_session(project_id, user_id)
             raise HTTPException(status_code=504, detail="智能体响应超时")
 
         except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP status error: {e.response.status_code}")
-            clear_session(project_id, user_id)
+            logger.error("HTTP status error: %s", e.response.status_code)
+            if e.response.status_code >= 500:
+                breaker.record_failure(permit)
+            await clear_session(project_id, user_id)
             raise HTTPException(
                 status_code=e.response.status_code,
                 detail=f"智能体服务错误: {e.response.status_code}"
@@ -242,11 +237,14 @@ async def call_coze_agent(
             raise
 
         except Exception as e:
-            logger.error(f"Unexpected error: {type(e).__name__} - {e}")
-            if attempt < max_retries - 1:
-                await asyncio.sleep(retry_delay * (attempt + 1))
+            logger.error("Unexpected error: %s - %s", type(e).__name__, e)
+            attempt += 1
+            breaker.record_failure(permit)
+            if attempt < max_retries and not received and not breaker.is_open():
+                upstream_retries.inc("error")
+                await asyncio.sleep(backoff_delay(attempt, retry_delay, RETRY_MAX_DELAY))
                 continue
-            clear_session(project_id, user_id)
+            await clear_session(project_id, user_id)
             raise HTTPException(status_code=500, detail=f"智能体调用失败: {str(e)}")
 
 
@@ -0,0 +1,177 @@
+import json
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, List, Optional
+
+# 有 orjson 时用它解析 JSON（逐 token 解析是流式路径上的主要 CPU 开销）
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # pragma: no cover
+    _loads = json.loads
+
+# 表示回答结束的消息类型
+END_TYPES = frozenset(("message_end", "done", "stop"))
+
+
+class SSEEvent:
+    """一个 SSE 事件（以空行分隔）"""
+    __slots__ = ("event", "id", "data_lines")
+
+    def __init__(self, event: str, id: Optional[str], data_lines: List[str]):
+        self.event = event
+        self.id = id
+        self.data_lines = data_lines
+
+    @property
+    def data(self) -> str:
+        return "\n".join(self.data_lines)
+
+
+class SSEParser:
+    """
+    增量 SSE 解析器
+
+    逐行喂入，遇到空行时返回完整事件；支持多行 data、event、id 字段和注释行。
+    id 字段按规范在事件之间保留（Last-Event-ID 语义）。
+    """
+    __slots__ = ("_event", "_id", "_data")
+
+    def __init__(self):
+        self._event = "message"
+        self._id: Optional[str] = None
+        self._data: List[str] = []
+
+    def feed_line(self, line: str) -> Optional[SSEEvent]:
+        if not line:
+            return self.flush()
+        # 快速路径：最常见的单行 "data: {...}" 直接成为事件
+        if not self._data and line.startswith("data: {") and line.endswith("}"):
+            event = SSEEvent(self._event, self._id, [line[6:]])
+            self._event = "message"
+            return event
+        if line[0] == ":":
+            return None
+
+        field, _, value = line.partition(":")
+        if value[:1] == " ":
+            value = value[1:]
+
+        if field == "data":
+            self._data.append(value)
+            # 单行的 JSON 对象立即作为完整事件分派，不等空行，
+            # 兼容不用空行分隔事件的上游，也不增加首字延迟
+            if len(self._data) == 1 and value[:1] == "{" and value.rstrip()[-1:] == "}":
+                return self.flush()
+        elif field == "event":
+            self._event = value
+        elif field == "id":
+            self._id = value
+        return None
+
+    def flush(self) -> Optional[SSEEvent]:
+        """结束当前事件；流结束时也要调用一次，处理末尾没有空行的事件"""
+        if not self._data:
+            self._event = "message"
+            return None
+        event = SSEEvent(self._event, self._id, self._data)
+        self._event = "message"
+        self._data = []
+        return event
+
+
+async def iter_sse_events(lines: AsyncIterable[str]) -> AsyncIterator[SSEEvent]:
+    """把行流解析为 SSE 事件流"""
+    parser = SSEParser()
+    async for line in lines:
+        event = parser.feed_line(line)
+        if event is not None:
+            yield event
+    event = parser.flush()
+    if event is not None:
+        yield event
+
+
+def decode_messages(event: SSEEvent) -> List[dict]:
+    """
+    解析事件中的 JSON 消息
+
+    正常情况下整个 data 是一个 JSON；若多行 data 各自是独立的 JSON
+    （部分上游不用空行分隔事件），则逐行解析。无法解析时抛出 ValueError。
+    """
+    lines = event.data_lines
+    if len(lines) == 1:
+        if not lines[0].strip():
+            return []
+        data = _loads(lines[0])
+        return [data] if isinstance(data, dict) else []
+
+    try:
+        data = _loads(event.data)
+        return [data] if isinstance(data, dict) else []
+    except ValueError:
+        messages = []
+        for line in lines:
+            if not line.strip():
+                continue
+            data = _loads(line)
+            if isinstance(data, dict):
+                messages.append(data)
+        return messages
+
+
+# ============ 文本提取 ============
+
+def _get(obj, key):
+    return obj.get(key) if isinstance(obj, dict) else None
+
+
+def _extract_answer(data: dict) -> str:
+    return _get(data.get("content"), "answer") or ""
+
+
+def _extract_message(data: dict) -> str:
+    content = data.get("content")
+    return (
+        _get(content, "answer") or
+        _get(content, "text") or
+        _get(content, "message") or
+        _get(_get(content, "delta"), "text") or
+        data.get("answer") or
+        data.get("text") or
+        _get(data.get("delta"), "text") or
+        ""
+    )
+
+
+def _extract_fallback(data: dict) -> str:
+    content = data.get("content")
+    return (
+        data.get("answer") or
+        data.get("text") or
+        data.get("message") or
+        (content if isinstance(content, str) else None) or
+        ""
+    )
+
+
+# 按消息类型分派的文本提取函数表
+_EXTRACTORS: Dict[str, Callable[[dict], str]] = {
+    "answer": _extract_answer,
+    "message_start": _extract_message,
+    "message": _extract_message,
+    "content_block_delta": _extract_message,
+    "delta": _extract_message,
+}
+
+
+def extract_text(data: dict) -> str:
+    """从一条 Coze 消息中提取回答文本"""
+    text = _EXTRACTORS.get(data.get("type", ""), _extract_fallback)(data)
+    return text if isinstance(text, str) else ""
+
+
+def end_error(data: dict) -> Optional[str]:
+    """结束消息携带错误（code=500）时返回错误信息"""
+    msg_end = _get(data.get("content"), "message_end")
+    if isinstance(msg_end, dict) and msg_end.get("code") == "500":
+        return msg_end.get("message", "Coze服务内部错误")
+    return None
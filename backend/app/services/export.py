@@ -0,0 +1,139 @@
+"""
+管理后台数据导出（NDJSON / CSV，可选 gzip）
+
+查询使用服务端游标（yield_per），按批读取、编码、压缩后立即发出，
+导出百万行时内存占用保持不变。生成器是同步的，由 StreamingResponse 在线程池中迭代，
+格式化和压缩不占用事件循环。
+"""
+import io
+import os
+import csv
+import json
+import zlib
+from datetime import date, datetime, time, timedelta
+from typing import Iterator, Optional
+from sqlalchemy import Result, column, select, table
+from sqlalchemy.orm import Session
+from ..database import SessionLocal
+from ..models import ChatMessage, User
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# 累计到该字节数再交给压缩/发送，减少线程池切换次数
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+# feedbacks 表没有 ORM 模型，这里只声明导出用到的列
+_feedbacks = table(
+    "feedbacks",
+    column("id"), column("user_id"), column("type"), column("content"),
+    column("contact"), column("page_url"), column("status"), column("created_at"),
+)
+
+
+def _date_range(query, created_at, start_date: Optional[date], end_date: Optional[date]):
+    """按创建日期过滤，起止日期都包含在内"""
+    if start_date is not None:
+        query = query.where(created_at >= datetime.combine(start_date, time.min))
+    if end_date is not None:
+        query = query.where(created_at < datetime.combine(end_date + timedelta(days=1), time.min))
+    return query
+
+
+def users_query(start_date: Optional[date] = None, end_date: Optional[date] = None):
+    # 不导出密码哈希
+    query = select(
+        User.id, User.phone, User.tier, User.tier_expire_at, User.binded_agents,
+        User.is_admin, User.is_active, User.created_at
+    ).order_by(User.id)
+    return _date_range(query, User.created_at, start_date, end_date)
+
+
+def feedbacks_query(start_date: Optional[date] = None, end_date: Optional[date] = None):
+    f = _feedbacks.c
+    query = select(
+        f.id, f.user_id, User.phone.label("user_phone"), f.type, f.content,
+        f.contact, f.page_url, f.status, f.created_at
+    ).select_from(_feedbacks.outerjoin(User, User.id == f.user_id)).order_by(f.id)
+    return _date_range(query, f.created_at, start_date, end_date)
+
+
+def messages_query(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    user_id: Optional[int] = None,
+    agent_id: Optional[int] = None
+):
+    query = select(
+        ChatMessage.id, ChatMessage.user_id, ChatMessage.agent_id,
+        ChatMessage.role, ChatMessage.content, ChatMessage.created_at
+    ).order_by(ChatMessage.id)
+    if user_id is not None:
+        query = query.where(ChatMessage.user_id == user_id)
+    if agent_id is not None:
+        query = query.where(ChatMessage.agent_id == agent_id)
+    return _date_range(query, ChatMessage.created_at, start_date, end_date)
+
+
+def _value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _encode_rows(db: Session, result: Result, fmt: str) -> Iterator[str]:
+    """逐批读取查询结果并编码，攒够约 EXPORT_CHUNK_BYTES 再产出一段文本"""
+    try:
+        keys = list(result.keys())
+        buffer = io.StringIO()
+        if fmt == "csv":
+            writer = csv.writer(buffer)
+            # BOM 让 Excel 按 UTF-8 打开中文
+            buffer.write("\ufeff")
+            writer.writerow(keys)
+        for rows in result.partitions():
+            for row in rows:
+                if fmt == "csv":
+                    writer.writerow(["" if value is None else _value(value) for value in row])
+                else:
+                    buffer.write(json.dumps(dict(zip(keys, map(_value, row))), ensure_ascii=False))
+                    buffer.write("\n")
+            if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        result.close()
+        db.close()
+
+
+def _gzip(chunks: Iterator[str]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31：gzip 格式
+    for text in chunks:
+        data = compressor.compress(text.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(query, fmt: str, compress: bool) -> Iterator[bytes]:
+    """
+    执行查询并返回响应体迭代器（UTF-8 文本，compress 为真时为 gzip 流）
+
+    查询在这里立即执行，出错时在发送响应头之前抛出，而不是返回一个中途断开的下载。
+    """
+    db = SessionLocal()
+    try:
+        result = db.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    except Exception:
+        db.close()
+        raise
+    chunks = _encode_rows(db, result, fmt)
+    if compress:
+        return _gzip(chunks)
+    return (text.encode() for text in chunks)
@@ -0,0 +1,141 @@
+import os
+import logging
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlsplit
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# SSL验证配置
+# 生产环境应设置 COZE_SSL_VERIFY=true
+# 开发环境如果Coze API有证书问题，可以设置为 false
+SSL_VERIFY = os.getenv("COZE_SSL_VERIFY", "false").lower() == "true"
+
+# 连接池配置（每个 Coze 端点 host 一个池）
+POOL_MAX_CONNECTIONS = int(os.getenv("COZE_POOL_MAX_CONNECTIONS", "50"))
+POOL_MAX_KEEPALIVE = int(os.getenv("COZE_POOL_MAX_KEEPALIVE", "20"))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("COZE_POOL_KEEPALIVE_EXPIRY", "60"))
+CONNECT_TIMEOUT = 10.0
+
+# 在复用的 keep-alive 连接上出现这些异常，通常说明对端已关闭了空闲连接；
+# 只有请求还没有完整写出时（见 AttemptTrace.stale）才能确定上游没有收到，可以立即重试
+STALE_CONNECTION_ERRORS = (httpx.RemoteProtocolError, httpx.ReadError, httpx.WriteError)
+
+
+def pool_key(url: str) -> str:
+    """连接池键：scheme://host[:port]"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+class AttemptTrace:
+    """记录单次请求是否新建了连接、请求体是否已完整写出"""
+
+    def __init__(self):
+        self.new_connection = False
+        self.request_sent = False
+
+    @property
+    def stale(self) -> bool:
+        """复用的连接在请求写完之前就断开：上游不可能已经受理，重发是安全的"""
+        return not self.new_connection and not self.request_sent
+
+
+class HostPool:
+    """单个上游 host 的共享连接池"""
+
+    def __init__(self, origin: str):
+        self.origin = origin
+        self.requests = 0
+        self.handshakes = 0
+        self.stale_retries = 0
+        self.client = httpx.AsyncClient(
+            verify=SSL_VERIFY,
+            timeout=httpx.Timeout(120.0, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_keepalive_connections=POOL_MAX_KEEPALIVE,
+                max_connections=POOL_MAX_CONNECTIONS,
+                keepalive_expiry=POOL_KEEPALIVE_EXPIRY
+            ),
+            http2=False  # 禁用 HTTP/2，避免连接复用问题
+        )
+
+    def _tracer(self, attempt: Optional[AttemptTrace]):
+        async def trace(event_name: str, info: dict):
+            # 每次新建 TCP 连接都会触发 connect_tcp，借此统计握手次数
+            if event_name == "connection.connect_tcp.complete":
+                self.handshakes += 1
+                if attempt is not None:
+                    attempt.new_connection = True
+            elif event_name == "http11.send_request_body.complete" and attempt is not None:
+                attempt.request_sent = True
+        return trace
+
+    def stream(
+        self,
+        method: str,
+        url: str,
+        timeout: Optional[float] = None,
+        attempt: Optional[AttemptTrace] = None,
+        **kwargs
+    ):
+        """在共享池上发起流式请求；timeout 为本次请求的读超时，attempt 用于记录连接状态"""
+        self.requests += 1
+        if timeout is not None:
+            kwargs["timeout"] = httpx.Timeout(timeout, connect=CONNECT_TIMEOUT)
+        extensions = kwargs.pop("extensions", {})
+        extensions["trace"] = self._tracer(attempt)
+        return self.client.stream(method, url, extensions=extensions, **kwargs)
+
+    def stats(self) -> dict:
+        idle = active = 0
+        transport_pool = getattr(self.client._transport, "_pool", None)
+        for conn in getattr(transport_pool, "connections", []):
+            if conn.is_idle():
+                idle += 1
+            else:
+                active += 1
+        return {
+            "origin": self.origin,
+            "idle": idle,
+            "active": active,
+            "requests": self.requests,
+            "handshakes": self.handshakes,
+            "stale_retries": self.stale_retries,
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_pools: Dict[str, HostPool] = {}
+
+
+def get_pool(url: str) -> HostPool:
+    """获取 url 所属 host 的连接池，不存在或已关闭则创建"""
+    key = pool_key(url)
+    pool = _pools.get(key)
+    if pool is None or pool.client.is_closed:
+        pool = HostPool(key)
+        _pools[key] = pool
+    return pool
+
+
+def init_pools(endpoints: Iterable[str]):
+    """启动时为已配置的智能体端点预先创建连接池"""
+    for endpoint in endpoints:
+        if endpoint:
+            get_pool(endpoint)
+    logger.info("Upstream pools initialized: %s", sorted(_pools))
+
+
+async def close_pools():
+    """关闭所有连接池（应用关闭时调用）"""
+    pools = list(_pools.values())
+    _pools.clear()
+    for pool in pools:
+        await pool.aclose()
+
+
+def pool_stats() -> list:
+    return [pool.stats() for pool in _pools.values()]
@@ -0,0 +1,226 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import insert
+from ..database import AsyncSessionLocal
+from ..metrics import chat_messages_dropped
+from ..models import ChatMessage
+from .circuit_breaker import backoff_delay
+from .usage import record_usage
+
+logger = logging.getLogger(__name__)
+
+# 写入队列配置
+WRITER_QUEUE_SIZE = int(os.getenv("CHAT_WRITER_QUEUE_SIZE", "10000"))
+WRITER_BATCH_SIZE = int(os.getenv("CHAT_WRITER_BATCH_SIZE", "200"))
+WRITER_FLUSH_INTERVAL = float(os.getenv("CHAT_WRITER_FLUSH_INTERVAL", "0.2"))  # 秒
+WRITER_PUT_TIMEOUT = float(os.getenv("CHAT_WRITER_PUT_TIMEOUT", "5"))  # 队列满时最长等待（秒）
+WRITER_WAIT_TIMEOUT = 5.0  # 等待某个用户的消息落库的最长时间（秒）
+# 写入失败时按指数退避一直重试，直到写入成功或应用关闭；关闭时再尝试一次，仍失败才丢弃
+WRITER_RETRY_DELAY = 0.5
+WRITER_RETRY_MAX_DELAY = float(os.getenv("CHAT_WRITER_RETRY_MAX_DELAY", "30"))  # 秒
+
+_STOP = object()
+
+
+class ChatMessageWriter:
+    """
+    ChatMessage 后台批量写入器（write-behind）
+
+    请求处理只负责把消息放入队列，后台任务按条数/时间攒批，
+    一个事务写入多行，减少 SQLite 上的小事务和 fsync 次数。
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+        # 队列中（含正在写入、重试中）的消息数：(user_id, agent_id) -> 条数
+        self._pending: Dict[Tuple[int, int], int] = {}
+        self._flushed = asyncio.Event()
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=WRITER_QUEUE_SIZE)
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止写入器，先把队列中剩余的消息全部落库（正在重试的批次不再等待退避）"""
+        if not self.running:
+            return
+        self._stopping.set()
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def submit(self, user_id: int, agent_id: int, role: str, content: str):
+        """提交一条消息；队列满时等待，超时返回 503"""
+        row = {
+            "user_id": user_id,
+            "agent_id": agent_id,
+            "role": role,
+            "content": content,
+            "created_at": datetime.utcnow(),
+        }
+        if not self.running:
+            # 写入器未启动（如脚本环境），直接同步落库
+            await self._write([row])
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.put(row), WRITER_PUT_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.error("Chat message queue is full, rejecting write")
+            raise HTTPException(status_code=503, detail="服务繁忙，请稍后再试")
+        self.enqueued += 1
+        key = (user_id, agent_id)
+        self._pending[key] = self._pending.get(key, 0) + 1
+
+    async def join(self):
+        """等待已提交的消息全部落库"""
+        if self.running:
+            await self._queue.join()
+
+    async def wait_flushed(self, user_id: int, agent_id: int, timeout: float = WRITER_WAIT_TIMEOUT) -> bool:
+        """
+        等待该用户与该智能体已提交的消息写入完成（成功或被丢弃），超时返回 False
+
+        只等这一组消息，其他用户的持续写入或某一批的退避重试不会让调用方无限等待。
+        """
+        key = (user_id, agent_id)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._pending.get(key):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._flushed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def _done(self, batch: List[dict]):
+        for row in batch:
+            key = (row["user_id"], row["agent_id"])
+            count = self._pending.get(key, 0) - 1
+            if count > 0:
+                self._pending[key] = count
+            else:
+                self._pending.pop(key, None)
+        # 唤醒当前所有等待者，之后的等待使用新的 Event
+        self._flushed.set()
+        self._flushed = asyncio.Event()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+
+            batch = [item]
+            deadline = loop.time() + WRITER_FLUSH_INTERVAL
+            while len(batch) < WRITER_BATCH_SIZE:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+            self._done(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _flush(self, batch: List[dict]):
+        """
+        写入一批消息，失败时退避后重试
+
+        重试期间新消息继续在队列中累积，队列满后 submit 返回 503，不会无限占用内存；
+        应用关闭时立即做最后一次尝试，仍然失败才丢弃并计入 dropped。
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                await self._write(batch)
+                return
+            except Exception as e:
+                if self._stopping.is_set():
+                    self.dropped += len(batch)
+                    chat_messages_dropped.inc(amount=len(batch))
+                    logger.exception("Dropped %d chat messages after %d attempts during shutdown", len(batch), attempt)
+                    return
+                self.retries += 1
+                logger.error("Chat message batch write failed (attempt %d), retrying: %s", attempt, e)
+                delay = backoff_delay(attempt, WRITER_RETRY_DELAY, WRITER_RETRY_MAX_DELAY)
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _write(self, batch: List[dict]):
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(ChatMessage), batch)
+            # 同一事务内累加使用次数，汇总与消息保持一致
+            await record_usage(db, batch)
+            await db.commit()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.written += len(batch)
+        self.batches += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.batches, 2) if self.batches else 0.0,
+            "total_flush_ms": round(self.total_flush_ms, 2),
+        }
+
+
+message_writer = ChatMessageWriter()
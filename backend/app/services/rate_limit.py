@@ -0,0 +1,138 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
+from fastapi import HTTPException, status
+from ..state import state_backend
+
+logger = logging.getLogger(__name__)
+
+# 智能体未单独配置时使用的默认速率（次/秒）与突发容量
+DEFAULT_RATE = float(os.getenv("COZE_RATE_LIMIT", "2"))
+DEFAULT_BURST = int(os.getenv("COZE_RATE_BURST", "2"))
+# 预计等待超过该时间（秒）直接返回 429，而不是无限排队
+MAX_WAIT = float(os.getenv("COZE_RATE_MAX_WAIT", "10"))
+
+
+class TokenBucket:
+    """
+    单个 project_id 的令牌桶（GCRA 实现）
+
+    每次请求在调用时就预约一个放行时间点：预约按调用顺序依次后延，
+    等待者按到达顺序放行（FIFO），不存在多个协程同时醒来抢令牌的竞争。
+    桶的状态只有一个数：理论到达时间（TAT，桶恰好被取空的时刻，Unix 时间戳），
+    保存在共享状态后端中，多个 worker 共用同一个桶。
+    """
+
+    def __init__(self, key: str, rate: float, burst: int):
+        self.key = f"rate:{key}"
+        self.rate = rate
+        self.burst = burst
+
+        # 统计
+        self.acquired = 0
+        self.rejected = 0
+        self.delayed = 0
+        self.waiting = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def configure(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+
+    def reserve(self, now: float, max_wait: float) -> Optional[float]:
+        """预约一个令牌，返回需要等待的秒数；超过 max_wait 时不占用令牌并返回 None"""
+        interval = 1.0 / self.rate
+
+        def update(tat):
+            tat = max(tat or 0.0, now)
+            wait = max(tat - (self.burst - 1) * interval - now, 0.0)
+            if wait > max_wait:
+                return tat, None
+            return tat + interval, wait
+
+        wait = state_backend.update(self.key, update)
+        if wait is None:
+            self.rejected += 1
+        return wait
+
+    def cancel(self, now: float):
+        """已预约的等待被取消（如客户端断开）时归还一个间隔"""
+        interval = 1.0 / self.rate
+        state_backend.update(self.key, lambda tat: (max((tat or 0.0) - interval, now), None))
+
+    def record(self, wait: float):
+        self.acquired += 1
+        if wait > 0:
+            self.delayed += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "acquired": self.acquired,
+            "rejected": self.rejected,
+            "delayed": self.delayed,
+            "waiting": self.waiting,
+            "avg_wait_ms": round(self.wait_total / self.delayed * 1000, 1) if self.delayed else 0.0,
+            "max_wait_ms": round(self.wait_max * 1000, 1),
+        }
+
+
+class RateLimiter:
+    """按 project_id 维护令牌桶"""
+
+    def __init__(self, max_wait: float = MAX_WAIT):
+        self.max_wait = max_wait
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def _bucket(self, key: str, rate: Optional[float], burst: Optional[int]) -> TokenBucket:
+        rate = rate if rate and rate > 0 else DEFAULT_RATE
+        burst = burst if burst and burst > 0 else DEFAULT_BURST
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(key, rate, burst)
+        elif bucket.rate != rate or bucket.burst != burst:
+            # 管理员修改了配置，沿用已有预约，按新速率继续
+            bucket.configure(rate, burst)
+        return bucket
+
+    async def acquire(self, key: str, rate: Optional[float] = None, burst: Optional[int] = None):
+        """获取一次调用许可，必要时排队等待；预计等待过长时抛出 429"""
+        bucket = self._bucket(key, rate, burst)
+        # 多 worker 共享状态时读写在线程中进行，不阻塞事件循环
+        wait = await self._call(bucket.reserve, time.time(), self.max_wait)
+        if wait is None:
+            logger.warning("Rate limit exceeded for project %s", key)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="请求过于频繁，请稍后再试",
+                headers={"Retry-After": str(max(int(self.max_wait), 1))}
+            )
+
+        if wait > 0:
+            bucket.waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                await self._call(bucket.cancel, time.time())
+                raise
+            finally:
+                bucket.waiting -= 1
+        bucket.record(wait)
+
+    @staticmethod
+    async def _call(fn, *args):
+        if state_backend.shared:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    def stats(self) -> dict:
+        return {key: bucket.stats() for key, bucket in self._buckets.items()}
+
+
+rate_limiter = RateLimiter()
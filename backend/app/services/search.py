@@ -0,0 +1,191 @@
+"""
+对话记录全文检索
+
+SQLite：FTS5 外部内容表 + trigram 分词（按连续 3 个字符建索引，中文不需要分词词典），
+由触发器与 chat_messages 保持同步，结果按 bm25 排序。trigram 无法检索不足 3 个字符的词，
+这些词在该用户的消息中用 LIKE 匹配（和长词同时出现时只过滤 FTS 命中的行）；
+消息不多的用户直接逐行匹配，不走 FTS（见 SEARCH_SCAN_ROWS）。
+
+PostgreSQL：中文不适合 tsvector 分词，改用 pg_trgm 的 GIN 索引加速 ILIKE，结果按时间倒序。
+"""
+import os
+import logging
+from typing import List, Optional, Tuple
+from sqlalchemy import column, func, select, table, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+SEARCH_MAX_TERMS = 5
+# 检索范围（该用户，或该用户与某个智能体）内的消息不超过该条数时，直接沿用户索引逐行匹配：
+# 常见词在全表 FTS 中命中的行很多，先全表匹配排序再按用户过滤反而更慢
+SEARCH_SCAN_ROWS = int(os.getenv("SEARCH_SCAN_ROWS", "10000"))
+SEARCH_SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "80"))
+TRIGRAM = 3
+
+FTS_TABLE = "chat_messages_fts"
+_fts = table(FTS_TABLE, column("rowid"), column("rank"))
+_fts_enabled = False
+_dialect = "sqlite"
+
+_SQLITE_FTS_TABLE = f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+    content, content='chat_messages', content_rowid='id', tokenize='trigram'
+)"""
+_SQLITE_FTS_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ai AFTER INSERT ON chat_messages BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ad AFTER DELETE ON chat_messages BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_messages_fts_au AFTER UPDATE OF content ON chat_messages BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+_POSTGRES_TRGM_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_chat_messages_content_trgm ON chat_messages USING gin (content gin_trgm_ops)",
+]
+
+
+def ensure_search_index(engine) -> bool:
+    """
+    启动时创建检索索引（建表之后调用，可重复执行）
+
+    SQLite 首次创建 FTS 表时从现有消息重建索引；当前 SQLite 不支持 FTS5/trigram 时
+    返回 False，检索退化为 LIKE 全量匹配。
+    """
+    global _fts_enabled, _dialect
+    dialect = _dialect = engine.dialect.name
+    try:
+        if dialect == "sqlite":
+            with engine.begin() as conn:
+                exists = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                    {"name": FTS_TABLE}
+                ).first()
+                if not exists:
+                    conn.execute(text(_SQLITE_FTS_TABLE))
+                    conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+                    logger.info("Built %s from existing chat messages", FTS_TABLE)
+                for statement in _SQLITE_FTS_TRIGGERS:
+                    conn.execute(text(statement))
+            _fts_enabled = True
+        elif dialect == "postgresql":
+            with engine.begin() as conn:
+                for statement in _POSTGRES_TRGM_DDL:
+                    conn.execute(text(statement))
+    except DBAPIError as e:
+        logger.warning("Chat search index unavailable, falling back to LIKE: %s", e)
+    return _fts_enabled
+
+
+def parse_terms(query: str) -> List[str]:
+    """按空白切分检索词（多个词同时匹配），去重后最多取 SEARCH_MAX_TERMS 个"""
+    terms: List[str] = []
+    for term in query.split():
+        if term not in terms:
+            terms.append(term)
+    return terms[:SEARCH_MAX_TERMS]
+
+
+def _like_pattern(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _match_expression(terms: List[str]) -> str:
+    # 每个词作为短语（双引号内的双引号写两次），空格分隔表示同时匹配
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+async def search_messages(
+    db: AsyncSession,
+    user_id: int,
+    terms: List[str],
+    agent_id: Optional[int],
+    limit: int,
+    offset: int
+) -> Tuple[List[ChatMessage], bool]:
+    """
+    检索该用户的消息，返回 (结果, 是否还有下一页)
+
+    走 FTS 时按 bm25 相关度排序；消息不多、或检索词都不足 3 个字符时逐行匹配，按时间倒序。
+    """
+    scope = [ChatMessage.user_id == user_id]
+    if agent_id is not None:
+        scope.append(ChatMessage.agent_id == agent_id)
+
+    indexed = [term for term in terms if len(term) >= TRIGRAM] if _fts_enabled else []
+    if indexed:
+        scope_rows = await db.scalar(select(func.count()).select_from(ChatMessage).where(*scope))
+        if scope_rows <= SEARCH_SCAN_ROWS:
+            indexed = []
+
+    query = select(ChatMessage).where(*scope)
+    if indexed:
+        query = query.join(_fts, _fts.c.rowid == ChatMessage.id).where(
+            text(f"{FTS_TABLE} MATCH :match").bindparams(match=_match_expression(indexed))
+        ).order_by(_fts.c.rank)
+    else:
+        query = query.order_by(ChatMessage.id.desc())
+    for term in terms:
+        if term not in indexed:
+            pattern = _like_pattern(term)
+            # SQLite 的 LIKE 本身不区分 ASCII 大小写，ilike 额外的 lower() 会拖慢逐行匹配
+            if _dialect == "sqlite":
+                query = query.where(ChatMessage.content.like(pattern, escape="\\"))
+            else:
+                query = query.where(ChatMessage.content.ilike(pattern, escape="\\"))
+
+    result = await db.execute(query.offset(offset).limit(limit + 1))
+    messages = list(result.scalars().all())
+    return messages[:limit], len(messages) > limit
+
+
+def make_snippet(content: str, terms: List[str], width: int = SEARCH_SNIPPET_CHARS) -> Tuple[str, List[Tuple[int, int]]]:
+    """
+    截取第一个命中位置附近的片段，返回 (片段, 高亮区间列表)
+
+    高亮区间为片段内的 [start, end) 下标，由前端渲染，避免把标记混入正文；
+    下标按 UTF-16 编码单元计算，与 JavaScript 字符串一致（emoji 占两个单元）。
+    """
+    lowered = content.lower()
+    if len(lowered) != len(content):
+        # 极少数字符小写后长度改变，此时下标无法对应，只按原文匹配
+        lowered = content
+    needles = [term.lower() for term in terms]
+
+    positions = [pos for pos in (lowered.find(needle) for needle in needles) if pos >= 0]
+    first = min(positions) if positions else 0
+    start = max(0, min(first - width // 4, len(content) - width))
+    end = min(len(content), start + width)
+
+    prefix = "…" if start > 0 else ""
+    snippet = prefix + content[start:end] + ("…" if end < len(content) else "")
+
+    window = lowered[start:end]
+    spans = []
+    for needle in needles:
+        pos = window.find(needle)
+        while pos >= 0:
+            spans.append((pos, pos + len(needle)))
+            pos = window.find(needle, pos + len(needle))
+    spans.sort()
+
+    highlights: List[Tuple[int, int]] = []
+    for begin, finish in spans:
+        if highlights and begin <= highlights[-1][1]:
+            highlights[-1] = (highlights[-1][0], max(highlights[-1][1], finish))
+        else:
+            highlights.append((begin, finish))
+    shift = len(prefix)
+    return snippet, [(_utf16_len(snippet, begin + shift), _utf16_len(snippet, finish + shift)) for begin, finish in highlights]
+
+
+def _utf16_len(value: str, index: int) -> int:
+    return len(value[:index].encode("utf-16-le")) // 2
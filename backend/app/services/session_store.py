@@ -0,0 +1,145 @@
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from ..cache import TTLCache
+from ..database import AsyncSessionLocal
+from ..models import CozeSession
+from ..state import publish, subscribe
+
+logger = logging.getLogger(__name__)
+
+# 会话存储后端：memory（单进程）/ database（多进程共享，重启后保留）
+SESSION_STORE = os.getenv("COZE_SESSION_STORE", "memory")
+SESSION_MAX = int(os.getenv("COZE_SESSION_MAX", "10000"))
+# 会话空闲超过该时间（秒）后开始新会话
+SESSION_IDLE_TTL = float(os.getenv("COZE_SESSION_IDLE_TTL", "86400"))
+# database 后端的本地缓存时间（秒），期间不访问数据库
+SESSION_LOCAL_TTL = float(os.getenv("COZE_SESSION_LOCAL_TTL", "60"))
+# database 后端刷新 updated_at 的最小间隔（秒），避免每次对话都写库
+SESSION_TOUCH_INTERVAL = 600
+
+
+def session_key(project_id: str, user_id: Optional[int] = None) -> str:
+    return f"{project_id}:{user_id or 'default'}"
+
+
+class MemorySessionStore:
+    """进程内会话存储：LRU 淘汰 + 空闲过期，内存有上限"""
+
+    def __init__(self, maxsize: int = SESSION_MAX, idle_ttl: float = SESSION_IDLE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=idle_ttl)
+        self.created = 0
+
+    async def get_or_create(self, key: str) -> str:
+        session_id = self._cache.get(key)
+        if session_id is None:
+            session_id = str(uuid.uuid4())
+            self.created += 1
+        # 每次使用都重新写入，过期时间按最后一次使用计算
+        self._cache.set(key, session_id)
+        return session_id
+
+    async def clear(self, key: str):
+        self._cache.pop(key)
+
+    async def purge_expired(self) -> int:
+        return 0
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "created": self.created, **self._cache.stats()}
+
+
+class DatabaseSessionStore:
+    """
+    数据库会话存储（coze_sessions 表）
+
+    新建会话直接写库（write-through），本地缓存未命中时再从库中读取（lazy load），
+    多个 worker 和重启后拿到的是同一个 session_id。本地缓存只保留 SESSION_LOCAL_TTL 秒。
+    """
+
+    def __init__(
+        self,
+        maxsize: int = SESSION_MAX,
+        idle_ttl: float = SESSION_IDLE_TTL,
+        local_ttl: float = SESSION_LOCAL_TTL
+    ):
+        self.idle_ttl = timedelta(seconds=idle_ttl)
+        self.touch_interval = timedelta(seconds=min(SESSION_TOUCH_INTERVAL, idle_ttl / 2))
+        self._local = TTLCache(maxsize=maxsize, ttl=local_ttl)
+        self.created = 0
+        self.loads = 0
+
+    async def get_or_create(self, key: str) -> str:
+        now = datetime.utcnow()
+        cached = self._local.get(key)
+        if cached is not None:
+            session_id, updated_at = cached
+            if now - updated_at < self.touch_interval:
+                return session_id
+
+        self.loads += 1
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(select(CozeSession).where(CozeSession.key == key))).scalar_one_or_none()
+            if row is not None and now - row.updated_at < self.idle_ttl:
+                # 仍在有效期内，按间隔刷新最后使用时间
+                if now - row.updated_at >= self.touch_interval:
+                    row.updated_at = now
+                    await db.commit()
+            else:
+                if row is None:
+                    row = CozeSession(key=key)
+                    db.add(row)
+                row.session_id = str(uuid.uuid4())
+                row.updated_at = now
+                try:
+                    await db.commit()
+                    self.created += 1
+                except IntegrityError:
+                    # 其他 worker 同时创建了该会话，使用已写入的那个
+                    await db.rollback()
+                    row = (await db.execute(select(CozeSession).where(CozeSession.key == key))).scalar_one()
+            session_id, updated_at = row.session_id, row.updated_at
+
+        self._local.set(key, (session_id, updated_at))
+        return session_id
+
+    async def clear(self, key: str):
+        self._local.pop(key)
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(CozeSession).where(CozeSession.key == key))
+            await db.commit()
+        # 其他 worker 的本地缓存也要失效
+        await asyncio.to_thread(publish, "coze_session", key)
+
+    def forget(self, key: str):
+        self._local.pop(key)
+
+    async def purge_expired(self) -> int:
+        """删除空闲过期的会话记录"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                delete(CozeSession).where(CozeSession.updated_at < datetime.utcnow() - self.idle_ttl)
+            )
+            await db.commit()
+        return result.rowcount or 0
+
+    def stats(self) -> dict:
+        return {"backend": "database", "created": self.created, "db_loads": self.loads, **self._local.stats()}
+
+
+def create_session_store():
+    if SESSION_STORE == "database":
+        store = DatabaseSessionStore()
+        subscribe("coze_session", store.forget)
+        return store
+    if SESSION_STORE != "memory":
+        logger.warning("Unknown COZE_SESSION_STORE=%r, using memory", SESSION_STORE)
+    return MemorySessionStore()
+
+
+session_store = create_session_store()
@@ -0,0 +1,98 @@
+import os
+import json
+import asyncio
+from json.encoder import encode_basestring
+from typing import AsyncIterable, AsyncIterator, List
+
+# 合并窗口：首个 token 立即发送，之后在窗口时间内或达到大小上限前合并为一帧
+SSE_COALESCE_WINDOW = float(os.getenv("SSE_COALESCE_WINDOW_MS", "20")) / 1000
+SSE_COALESCE_BYTES = int(os.getenv("SSE_COALESCE_BYTES", "512"))
+
+DONE_FRAME = "data: [DONE]\n\n"
+
+
+def content_frame(text: str) -> str:
+    """文本帧，与 json.dumps({'content': text}, ensure_ascii=False) 输出一致"""
+    return 'data: {"content": ' + encode_basestring(text) + '}\n\n'
+
+
+def queue_frame(position: int) -> str:
+    """排队位置帧：等待上游调用名额时发送，0 表示已放行"""
+    return 'data: {"queue": {"position": ' + str(position) + '}}\n\n'
+
+
+def error_frame(detail) -> str:
+    return f"data: {json.dumps({'error': detail}, ensure_ascii=False)}\n\n"
+
+
+async def coalesce_chunks(
+    chunks: AsyncIterable[str],
+    window: float = SSE_COALESCE_WINDOW,
+    max_bytes: int = SSE_COALESCE_BYTES
+) -> AsyncIterator[str]:
+    """
+    合并上游的细碎文本块，减少 SSE 帧数和 socket 写入次数
+
+    - 首个文本块立即输出，不影响首字延迟
+    - 之后从窗口内第一个块开始计时，到期或累计达到 max_bytes 即输出
+    - 上游结束或出错时立即输出剩余内容
+    """
+    it = chunks.__aiter__()
+    loop = asyncio.get_running_loop()
+    buffer: List[str] = []
+    size = 0
+    deadline = 0.0
+    first = True
+    pending = None
+
+    try:
+        while True:
+            try:
+                if buffer:
+                    # 有待发送内容时带超时等待下一块，窗口到期先输出
+                    pending = asyncio.ensure_future(it.__anext__())
+                    done, _ = await asyncio.wait({pending}, timeout=max(deadline - loop.time(), 0))
+                    if not done:
+                        yield "".join(buffer)
+                        buffer.clear()
+                        size = 0
+                    chunk = await pending
+                    pending = None
+                else:
+                    chunk = await it.__anext__()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                pending = None
+                if buffer:
+                    yield "".join(buffer)
+                    buffer.clear()
+                raise
+
+            if first:
+                first = False
+                yield chunk
+                continue
+
+            if not buffer:
+                deadline = loop.time() + window
+            buffer.append(chunk)
+            size += len(chunk.encode())
+            if size >= max_bytes or window <= 0:
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        # 客户端断开时取消正在等待的上游读取，并关闭上游生成器释放连接
+        if pending is not None and not pending.done():
+            pending.cancel()
+            try:
+                await pending
+            except BaseException:
+                pass
+        aclose = getattr(it, "aclose", None)
+        if aclose is not None:
+            await aclose()
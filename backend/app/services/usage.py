@@ -0,0 +1,92 @@
+"""
+用户-智能体使用次数汇总（user_agent_usage 表）
+
+消息写入器落库时在同一事务内累加计数，个人中心统计只需按用户读取少量汇总行。
+升级后首次启动会自动从 chat_messages 回填；也可以手动重建：
+
+    python -m app.backfill_usage
+"""
+import logging
+from typing import Dict, List, Tuple
+from sqlalchemy import case, delete, func, insert, select
+from sqlalchemy.orm import Session
+from ..models import ChatMessage, UserAgentUsage
+
+logger = logging.getLogger(__name__)
+
+
+def _aggregate(rows: List[dict]) -> List[dict]:
+    """把一批消息按 (用户, 智能体) 合并为计数增量，只统计用户发送的消息"""
+    usage: Dict[Tuple[int, int], dict] = {}
+    for row in rows:
+        if row["role"] != "user":
+            continue
+        key = (row["user_id"], row["agent_id"])
+        item = usage.get(key)
+        if item is None:
+            usage[key] = {
+                "user_id": row["user_id"],
+                "agent_id": row["agent_id"],
+                "message_count": 1,
+                "last_used_at": row["created_at"],
+            }
+        else:
+            item["message_count"] += 1
+            item["last_used_at"] = max(item["last_used_at"], row["created_at"])
+    return list(usage.values())
+
+
+def _upsert(dialect: str):
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    stmt = dialect_insert(UserAgentUsage)
+    return stmt.on_conflict_do_update(
+        index_elements=[UserAgentUsage.user_id, UserAgentUsage.agent_id],
+        set_={
+            "message_count": UserAgentUsage.message_count + stmt.excluded.message_count,
+            "last_used_at": case(
+                (UserAgentUsage.last_used_at.is_(None), stmt.excluded.last_used_at),
+                (stmt.excluded.last_used_at > UserAgentUsage.last_used_at, stmt.excluded.last_used_at),
+                else_=UserAgentUsage.last_used_at
+            ),
+        }
+    )
+
+
+async def record_usage(db, rows: List[dict]):
+    """在调用方的事务内累加一批消息的使用次数（db 为 AsyncSession，由调用方提交）"""
+    usage = _aggregate(rows)
+    if usage:
+        await db.execute(_upsert(db.bind.dialect.name), usage)
+
+
+def rebuild_usage(db: Session) -> int:
+    """从 chat_messages 重建汇总表，返回写入的行数"""
+    db.execute(delete(UserAgentUsage))
+    result = db.execute(
+        insert(UserAgentUsage).from_select(
+            ["user_id", "agent_id", "message_count", "last_used_at"],
+            select(
+                ChatMessage.user_id,
+                ChatMessage.agent_id,
+                func.count(),
+                func.max(ChatMessage.created_at)
+            ).where(ChatMessage.role == "user").group_by(ChatMessage.user_id, ChatMessage.agent_id)
+        )
+    )
+    db.commit()
+    return result.rowcount or 0
+
+
+def backfill_usage_if_empty(db: Session) -> int:
+    """汇总表为空但已有历史消息时（刚升级），自动回填一次"""
+    if db.execute(select(UserAgentUsage.user_id).limit(1)).first() is not None:
+        return 0
+    if db.execute(select(ChatMessage.id).where(ChatMessage.role == "user").limit(1)).first() is None:
+        return 0
+    count = rebuild_usage(db)
+    logger.info("Backfilled %d user_agent_usage rows from chat_messages", count)
+    return count
+
@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 跨请求共享状态的存储后端：
+#   memory —— 单进程（默认）
+#   sqlite —— 多 worker 共享，使用独立的 WAL 模式 SQLite 文件
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "./luna_state.db")
+# 其他 worker 发布的失效事件的轮询间隔（秒）
+STATE_POLL_INTERVAL = float(os.getenv("STATE_POLL_INTERVAL", "1"))
+# 事件保留时间（秒），超过后清理
+EVENT_RETENTION = 60.0
+# 多 worker 启动时串行执行初始化所用的锁文件
+STARTUP_LOCK_FILE = os.getenv("STARTUP_LOCK_FILE", "./.luna_startup.lock")
+
+Updater = Callable[[Optional[Any]], Tuple[Any, Any]]
+
+
+class MemoryStateBackend:
+    """单进程状态：普通字典，事件无需广播"""
+    shared = False
+
+    def __init__(self):
+        self._kv: Dict[str, Any] = {}
+
+    def update(self, key: str, fn: Updater) -> Any:
+        """原子地读-改-写一个值：fn(旧值) -> (新值, 返回结果)"""
+        value, result = fn(self._kv.get(key))
+        self._kv[key] = value
+        return result
+
+    def delete(self, key: str):
+        self._kv.pop(key, None)
+
+    def publish(self, channel: str, payload: Any = None):
+        pass
+
+    def poll(self, since: int) -> Tuple[int, List[Tuple[str, Any]]]:
+        return since, []
+
+    def last_event_id(self) -> int:
+        return 0
+
+
+class SQLiteStateBackend:
+    """
+    多进程共享状态：WAL 模式的 SQLite 文件
+
+    update() 在 BEGIN IMMEDIATE 事务内执行，同一时刻只有一个进程能读改写；
+    publish() 写入事件表，各 worker 轮询后在本进程内执行失效。
+    """
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pid = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._last_prune = 0.0
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # 按进程建立连接：fork 出来的 worker 不能沿用父进程的连接
+        if self._db is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, payload TEXT, "
+                "origin INTEGER NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db = conn
+        return self._db
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def update(self, key: str, fn: Updater) -> Any:
+        with self._transaction() as conn:
+            row = conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+            value, result = fn(json.loads(row[0]) if row else None)
+            conn.execute(
+                "INSERT INTO kv (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, json.dumps(value))
+            )
+        return result
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def publish(self, channel: str, payload: Any = None):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO events (channel, payload, origin, created_at) VALUES (?, ?, ?, ?)",
+                (channel, json.dumps(payload), os.getpid(), time.time())
+            )
+
+    def poll(self, since: int) -> Tuple[int, List[Tuple[str, Any]]]:
+        """返回 since 之后其他进程发布的事件"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, channel, payload, origin FROM events WHERE id > ? ORDER BY id", (since,)
+            ).fetchall()
+            now = time.time()
+            if now - self._last_prune > EVENT_RETENTION:
+                self._last_prune = now
+                self._conn.execute("DELETE FROM events WHERE created_at < ?", (now - EVENT_RETENTION,))
+        if rows:
+            since = rows[-1][0]
+        pid = os.getpid()
+        return since, [(channel, json.loads(payload)) for _, channel, payload, origin in rows if origin != pid]
+
+    def last_event_id(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(id) FROM events").fetchone()
+        return row[0] or 0
+
+
+def create_state_backend():
+    if STATE_BACKEND == "sqlite":
+        return SQLiteStateBackend(STATE_DB_PATH)
+    if STATE_BACKEND != "memory":
+        logger.warning("Unknown STATE_BACKEND=%r, using memory", STATE_BACKEND)
+    return MemoryStateBackend()
+
+
+state_backend = create_state_backend()
+
+
+# ============ 跨 worker 失效 ============
+
+_handlers: Dict[str, Callable[[Any], Any]] = {}
+_listener: Optional[asyncio.Task] = None
+
+
+def subscribe(channel: str, handler: Callable[[Any], Any]):
+    """注册其他 worker 发布的事件的处理函数（handler 可以是协程函数）"""
+    _handlers[channel] = handler
+
+
+def publish(channel: str, payload: Any = None):
+    """通知其他 worker（本进程的处理由调用方自己完成）"""
+    if state_backend.shared:
+        try:
+            state_backend.publish(channel, payload)
+        except sqlite3.Error as e:
+            logger.error("Failed to publish %s event: %s", channel, e)
+
+
+async def _listen(since: int):
+    while True:
+        await asyncio.sleep(STATE_POLL_INTERVAL)
+        try:
+            since, events = await asyncio.to_thread(state_backend.poll, since)
+        except sqlite3.Error as e:
+            logger.error("Failed to poll state events: %s", e)
+            continue
+        for channel, payload in events:
+            handler = _handlers.get(channel)
+            if handler is None:
+                continue
+            try:
+                result = handler(payload)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error("State event handler %s failed: %s", channel, e)
+
+
+def start_listener():
+    """开始接收事件；在加载目录等状态之前调用，之后发布的事件都不会漏掉"""
+    global _listener
+    if state_backend.shared and _listener is None:
+        since = state_backend.last_event_id()
+        _listener = asyncio.get_running_loop().create_task(_listen(since))
+
+
+async def stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
+
+
+# ============ 启动锁 ============
+
+@contextmanager
+def startup_lock():
+    """多个 worker 同时启动时，串行执行建表、创建管理员等初始化步骤"""
+    try:
+        import fcntl
+    except ImportError:  # pragma: no cover - Windows 下只支持单进程
+        yield
+        return
+    with open(STARTUP_LOCK_FILE, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,287 @@
+"""
+对话接口压测：注册用户、登录，并发调用 /api/agents/{id}/chat 流式对话
+
+输出首字延迟（TTFT）、整体耗时、每个流的出字速率（tokens/s，按字数计）的 p50/p95/p99，
+以及压测期间消息写入队列的批次数和落库耗时（取自 /api/admin/runtime）。
+
+用法（在 backend 目录下，先启动模拟 Coze 服务和后端）：
+    python -m benchmarks.mock_coze --port 18081 &
+    ADMIN_DEFAULT_PASSWORD=... python -m uvicorn app.main:app --port 8000 &
+    python -m benchmarks.load_chat --mock-url http://127.0.0.1:18081/stream_run \\
+        --users 20 --concurrency 20 --requests 200 --save baseline.json
+
+之后修改代码再跑一次并与基线对比：
+    python -m benchmarks.load_chat --mock-url ... --compare baseline.json
+
+不指定 --agent-id 时会创建（或复用）一个名为“压测智能体”的智能体，指向 --mock-url，
+限流和并发上限设得足够大，测到的是服务本身而不是限流配置。
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+BENCH_AGENT_NAME = "压测智能体"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法百分位"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values), 2) if values else 0.0,
+    }
+
+
+class Result:
+    __slots__ = ("status", "error", "ttft", "duration", "chars", "queued")
+
+    def __init__(self):
+        self.status = 0
+        self.error: Optional[str] = None
+        self.ttft: Optional[float] = None
+        self.duration = 0.0
+        self.chars = 0
+        self.queued = False
+
+
+async def admin_login(client: httpx.AsyncClient, phone: str, password: str) -> dict:
+    resp = await client.post("/api/auth/login", json={"phone": phone, "password": password})
+    if resp.status_code != 200:
+        raise SystemExit(f"Admin login failed: {resp.status_code} {resp.text}")
+    return {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+
+async def prepare_agent(client: httpx.AsyncClient, admin: dict, args) -> int:
+    if args.agent_id:
+        return args.agent_id
+    if not args.mock_url:
+        raise SystemExit("Either --agent-id or --mock-url is required")
+
+    config = {
+        "name": BENCH_AGENT_NAME,
+        "api_endpoint": args.mock_url,
+        "api_token": "bench",
+        "project_id": "7000000000000000001",
+        "rate_limit": args.rate_limit,
+        "rate_burst": max(int(args.rate_limit), 1),
+        "max_in_flight": args.max_in_flight,
+        "queue_depth": args.max_in_flight,
+    }
+    agents = (await client.get("/api/admin/agents", headers=admin)).json()
+    for agent in agents:
+        if agent["name"] == BENCH_AGENT_NAME:
+            resp = await client.put(f"/api/admin/agents/{agent['id']}", headers=admin, json=config)
+            resp.raise_for_status()
+            return agent["id"]
+    resp = await client.post("/api/admin/agents", headers=admin, json=config)
+    resp.raise_for_status()
+    return resp.json()["id"]
+
+
+async def prepare_users(client: httpx.AsyncClient, admin: dict, args) -> List[dict]:
+    """注册并登录压测用户（已存在时直接登录），会员等级设为 args.tier"""
+    semaphore = asyncio.Semaphore(8)  # 注册/登录要做 bcrypt，别把服务压垮在准备阶段
+
+    async def one(i: int) -> dict:
+        phone = f"{args.user_prefix}{i:05d}"
+        async with semaphore:
+            await client.post("/api/auth/register", json={"phone": phone, "password": args.user_password})
+            resp = await client.post("/api/auth/login", json={"phone": phone, "password": args.user_password})
+            resp.raise_for_status()
+            data = resp.json()
+            if data["user"]["tier"] != args.tier:
+                await client.put(f"/api/admin/users/{data['user']['id']}", headers=admin, json={"tier": args.tier})
+        return {"Authorization": f"Bearer {data['access_token']}"}
+
+    return await asyncio.gather(*(one(i) for i in range(args.users)))
+
+
+async def chat_once(client: httpx.AsyncClient, headers: dict, agent_id: int, message: str) -> Result:
+    result = Result()
+    started = time.perf_counter()
+    try:
+        async with client.stream("POST", f"/api/agents/{agent_id}/chat", headers=headers, json={"message": message}) as resp:
+            result.status = resp.status_code
+            if resp.status_code != 200:
+                await resp.aread()
+                result.error = f"http_{resp.status_code}"
+                return result
+            async for line in resp.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[6:]
+                if data == "[DONE]":
+                    break
+                frame = json.loads(data)
+                if "content" in frame:
+                    if result.ttft is None:
+                        result.ttft = time.perf_counter() - started
+                    result.chars += len(frame["content"])
+                elif "queue" in frame:
+                    result.queued = True
+                elif "error" in frame:
+                    result.error = "stream_error"
+    except httpx.HTTPError as e:
+        result.error = type(e).__name__
+    finally:
+        result.duration = time.perf_counter() - started
+    return result
+
+
+async def run_load(client: httpx.AsyncClient, users: List[dict], agent_id: int, args) -> Tuple[List[Result], float]:
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(i)
+    results: List[Result] = []
+
+    async def worker():
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            results.append(await chat_once(client, users[i % len(users)], agent_id, f"{args.message} #{i}"))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return results, time.perf_counter() - started
+
+
+def build_report(results: List[Result], elapsed: float, before: dict, after: dict) -> dict:
+    ok = [r for r in results if r.error is None]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if r.error:
+            errors[r.error] = errors.get(r.error, 0) + 1
+
+    ttft_ms = [r.ttft * 1000 for r in ok if r.ttft is not None]
+    duration_ms = [r.duration * 1000 for r in ok]
+    # 单个流的出字速率：首字之后的字数 / 首字之后的时长
+    stream_rate = [
+        r.chars / (r.duration - r.ttft) for r in ok
+        if r.ttft is not None and r.duration > r.ttft
+    ]
+
+    writer_before = before.get("chat_writer", {})
+    writer_after = after.get("chat_writer", {})
+    batches = writer_after.get("batches", 0) - writer_before.get("batches", 0)
+    flush_ms = writer_after.get("total_flush_ms", 0.0) - writer_before.get("total_flush_ms", 0.0)
+
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": errors,
+        "queued": sum(1 for r in results if r.queued),
+        "elapsed_s": round(elapsed, 2),
+        "requests_per_s": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "tokens_per_s": round(sum(r.chars for r in ok) / elapsed, 1) if elapsed else 0.0,
+        "ttft_ms": summarize(ttft_ms),
+        "duration_ms": summarize(duration_ms),
+        "stream_tokens_per_s": summarize(stream_rate),
+        "db_write": {
+            "messages": writer_after.get("written", 0) - writer_before.get("written", 0),
+            "batches": batches,
+            "avg_flush_ms": round(flush_ms / batches, 2) if batches else 0.0,
+            "max_flush_ms": writer_after.get("max_flush_ms", 0.0),
+            "dropped": writer_after.get("dropped", 0) - writer_before.get("dropped", 0),
+        },
+    }
+
+
+def print_report(report: dict, baseline: Optional[dict] = None):
+    def delta(path: List[str]) -> str:
+        if baseline is None:
+            return ""
+        old = baseline
+        new = report
+        for key in path:
+            old = old.get(key, {}) if isinstance(old, dict) else {}
+            new = new[key]
+        if not isinstance(old, (int, float)) or not old:
+            return ""
+        return f"  ({(new - old) / old * 100:+.1f}%)"
+
+    print(f"requests     {report['ok']}/{report['requests']} ok, {report['queued']} queued, errors: {report['errors'] or '-'}")
+    print(f"elapsed      {report['elapsed_s']}s")
+    print(f"throughput   {report['requests_per_s']} req/s{delta(['requests_per_s'])}, "
+          f"{report['tokens_per_s']} tokens/s{delta(['tokens_per_s'])}")
+    for name, unit in (("ttft_ms", "ms"), ("duration_ms", "ms"), ("stream_tokens_per_s", "tok/s")):
+        parts = [f"{key} {value}{delta([name, key])}" for key, value in report[name].items()]
+        print(f"{name:<20} " + ", ".join(parts) + f"  [{unit}]")
+    db = report["db_write"]
+    print(f"db_write     {db['messages']} messages in {db['batches']} batches, "
+          f"avg {db['avg_flush_ms']}ms{delta(['db_write', 'avg_flush_ms'])}, max {db['max_flush_ms']}ms, dropped {db['dropped']}")
+
+
+async def main_async(args):
+    limits = httpx.Limits(max_connections=args.concurrency + 10, max_keepalive_connections=args.concurrency + 10)
+    timeout = httpx.Timeout(args.timeout, connect=10.0)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=timeout) as client:
+        admin = await admin_login(client, args.admin_phone, args.admin_password)
+        agent_id = await prepare_agent(client, admin, args)
+        users = await prepare_users(client, admin, args)
+        print(f"agent {agent_id}, {len(users)} users, {args.concurrency} concurrent, {args.requests} requests")
+
+        # 预热：建立上游连接池
+        await chat_once(client, users[0], agent_id, "warmup")
+
+        before = (await client.get("/api/admin/runtime", headers=admin)).json()
+        results, elapsed = await run_load(client, users, agent_id, args)
+        # 等待写入队列落库后再取统计
+        await asyncio.sleep(1.0)
+        after = (await client.get("/api/admin/runtime", headers=admin)).json()
+
+    return build_report(results, elapsed, before, after)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat endpoint load test")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--admin-phone", default="admin")
+    parser.add_argument("--admin-password", default=os.getenv("ADMIN_DEFAULT_PASSWORD"))
+    parser.add_argument("--agent-id", type=int, help="existing agent to call (skip creating the bench agent)")
+    parser.add_argument("--mock-url", help="mock Coze endpoint for the bench agent")
+    parser.add_argument("--rate-limit", type=float, default=1000.0, help="bench agent rate limit (req/s)")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="bench agent concurrency limit and queue depth")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--user-prefix", default="bench")
+    parser.add_argument("--user-password", default="bench-password")
+    parser.add_argument("--tier", default="3980")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--message", default="帮我写一份新品推广方案")
+    parser.add_argument("--timeout", type=float, default=300.0, help="per-request read timeout (s)")
+    parser.add_argument("--save", help="write the report as JSON (e.g. as a baseline)")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    args = parser.parse_args()
+    if not args.admin_password:
+        raise SystemExit("--admin-password or ADMIN_DEFAULT_PASSWORD is required")
+
+    report = asyncio.run(main_async(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
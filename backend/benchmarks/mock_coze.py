@@ -0,0 +1,124 @@
+"""
+本地模拟 Coze 流式接口，用于压测（不消耗真实额度，结果可复现）
+
+输出与 Coze stream_run 一致的 SSE 事件流：message_start → 若干 answer → message_end。
+可配置首字延迟、出字速率、每块字数，并按比例注入 HTTP 500 和中途断流。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.mock_coze --port 18081
+    python -m benchmarks.mock_coze --port 18081 --tokens 300 --token-rate 60 --latency-ms 500 --error-rate 0.02
+
+智能体的 api_endpoint 配置为 http://127.0.0.1:18081/stream_run，project_id 任意数字。
+GET /stats 返回已处理的请求数、注入的错误数和发送的 token 数。
+"""
+import argparse
+import asyncio
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from .bench_sse_parser import SAMPLE_TEXT
+
+
+class MockConfig:
+    tokens = 200  # 每个回答的 token（answer 事件）数
+    token_rate = 40.0  # 每秒输出的 token 数，0 表示不限速
+    chunk_chars = 2  # 每个 token 的字数
+    latency_ms = 300.0  # 首个 token 前的延迟
+    jitter = 0.2  # 延迟和出字间隔的随机抖动比例
+    error_rate = 0.0  # 直接返回 HTTP 500 的比例
+    drop_rate = 0.0  # 输出一半后断开连接的比例
+
+
+config = MockConfig()
+counters = {"requests": 0, "errors": 0, "drops": 0, "completed": 0, "tokens": 0, "active": 0}
+
+app = FastAPI()
+
+
+def _jittered(seconds: float) -> float:
+    if seconds <= 0:
+        return 0.0
+    return seconds * random.uniform(1 - config.jitter, 1 + config.jitter)
+
+
+def _event(seq: int, data: dict) -> str:
+    return f"event: message\nid: {seq}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _stream(session_id: str, drop: bool):
+    counters["active"] += 1
+    try:
+        await asyncio.sleep(_jittered(config.latency_ms / 1000))
+        yield _event(0, {"type": "message_start", "content": {"message_start": {"local_message_id": session_id}}})
+
+        interval = 1.0 / config.token_rate if config.token_rate > 0 else 0.0
+        pos = random.randrange(len(SAMPLE_TEXT))
+        for seq in range(1, config.tokens + 1):
+            if drop and seq > config.tokens // 2:
+                counters["drops"] += 1
+                raise ConnectionAbortedError("mock stream dropped")
+            piece = (SAMPLE_TEXT * 2)[pos:pos + config.chunk_chars]
+            pos = (pos + config.chunk_chars) % len(SAMPLE_TEXT)
+            yield _event(seq, {
+                "type": "answer",
+                "session_id": session_id,
+                "content": {"answer": piece, "thinking": None, "tool_request": None},
+            })
+            counters["tokens"] += 1
+            if interval:
+                await asyncio.sleep(_jittered(interval))
+
+        yield _event(config.tokens + 1, {"type": "message_end", "content": {"message_end": {"code": "0", "message": ""}}})
+        counters["completed"] += 1
+    finally:
+        counters["active"] -= 1
+
+
+@app.post("/stream_run")
+async def stream_run(request: Request):
+    body = await request.json()
+    counters["requests"] += 1
+    if random.random() < config.error_rate:
+        counters["errors"] += 1
+        await asyncio.sleep(_jittered(config.latency_ms / 1000))
+        return JSONResponse({"code": 5000, "msg": "mock internal error"}, status_code=500)
+    session_id = str(body.get("session_id") or body.get("project_id", ""))
+    return StreamingResponse(
+        _stream(session_id, random.random() < config.drop_rate),
+        media_type="text/event-stream"
+    )
+
+
+@app.get("/stats")
+async def stats():
+    return counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Coze SSE server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18081)
+    parser.add_argument("--tokens", type=int, default=config.tokens, help="answer events per response")
+    parser.add_argument("--token-rate", type=float, default=config.token_rate, help="tokens per second per stream, 0 = unlimited")
+    parser.add_argument("--chunk-chars", type=int, default=config.chunk_chars, help="characters per token")
+    parser.add_argument("--latency-ms", type=float, default=config.latency_ms, help="delay before the first token")
+    parser.add_argument("--jitter", type=float, default=config.jitter, help="random +/- fraction applied to delays")
+    parser.add_argument("--error-rate", type=float, default=config.error_rate, help="fraction of requests answered with HTTP 500")
+    parser.add_argument("--drop-rate", type=float, default=config.drop_rate, help="fraction of streams cut off halfway")
+    parser.add_argument("--seed", type=int, help="random seed for reproducible error injection")
+    args = parser.parse_args()
+
+    for name in ("tokens", "token_rate", "chunk_chars", "latency_ms", "jitter", "error_rate", "drop_rate"):
+        setattr(config, name, getattr(args, name))
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -48,11 +48,11 @@ function SafeMarkdown({ content }) {
 }
 
 // 思考中动画组件
-function ThinkingIndicator() {
+function ThinkingIndicator({ queuePosition }) {
   return (
     <div className="flex flex-col gap-1">
       <div className="flex items-center gap-2">
-        <span className="text-[#86868B] text-sm">思考中</span>
+        <span className="text-[#86868B] text-sm">{queuePosition ? '排队中' : '思考中'}</span>
         <div className="flex gap-1">
           <span
             className="w-1.5 h-1.5 bg-[#0066CC] rounded-full animate-bounce"
@@ -68,11 +68,31 @@ function ThinkingIndicator() {
           />
         </div>
       </div>
-      <span className="text-[#AEAEB2] text-xs">通常需要2-5秒</span>
+      <span className="text-[#AEAEB2] text-xs">
+        {queuePosition ? `当前使用人数较多，前面还有 ${queuePosition - 1} 人` : '通常需要2-5秒'}
+      </span>
     </div>
   )
 }
 
+// 检索结果片段，highlights 为需要高亮的 [start, end) 区间
+function HighlightedSnippet({ text, highlights }) {
+  const parts = []
+  let last = 0
+  ;(highlights || []).forEach(([start, end], idx) => {
+    if (start > last) parts.push(text.slice(last, start))
+    parts.push(
+      <mark key={idx} className="bg-[#FFF3C4] text-inherit rounded px-0.5">{text.slice(start, end)}</mark>
+    )
+    last = end
+  })
+  parts.push(text.slice(last))
+  return <span className="whitespace-pre-wrap">{parts}</span>
+}
+
+// 每次加载的历史消息条数
+const HISTORY_PAGE_SIZE = 50
+
 export default function Chat() {
   const { agentId } = useParams()
   const navigate = useNavigate()
@@ -82,10 +102,20 @@ export default function Chat() {
   const [input, setInput] = useState('')
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState('')
+  const [nextBeforeId, setNextBeforeId] = useState(null)
+  const [loadingMore, setLoadingMore] = useState(false)
+  const [queuePosition, setQueuePosition] = useState(null)
+  // 对话记录检索：searchResults 为 null 表示尚未检索
+  const [showSearch, setShowSearch] = useState(false)
+  const [searchQuery, setSearchQuery] = useState('')
+  const [searchResults, setSearchResults] = useState(null)
+  const [searchNextOffset, setSearchNextOffset] = useState(null)
+  const [searching, setSearching] = useState(false)
 
   const messagesEndRef = useRef(null)
   const inputRef = useRef(null)
   const isFetching = useRef(false)
+  const skipScroll = useRef(false)
 
   // 加载数据
   useEffect(() => {
@@ -101,7 +131,7 @@ export default function Chat() {
       try {
         const [agentData, historyData] = await Promise.all([
           agents.get(agentId),
-          agents.getHistory(agentId)
+          agents.getHistory(agentId, { limit: HISTORY_PAGE_SIZE })
         ])
 
         setAgent(agentData)
@@ -112,6 +142,7 @@ export default function Chat() {
             content: String(m.content || '')
           })))
         }
+        setNextBeforeId(historyData.has_more ? historyData.next_before_id : null)
       } catch (err) {
         console.error('Load failed:', err)
         window.location.href = '/'
@@ -121,11 +152,39 @@ export default function Chat() {
     load()
   }, [])
 
-  // 滚动到底部
+  // 滚动到底部（加载更早的消息时保持当前位置）
   useEffect(() => {
+    if (skipScroll.current) {
+      skipScroll.current = false
+      return
+    }
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' })
   }, [messages])
 
+  const handleLoadMore = async () => {
+    if (!nextBeforeId || loadingMore) return
+    setLoadingMore(true)
+    try {
+      const historyData = await agents.getHistory(agentId, {
+        beforeId: nextBeforeId,
+        limit: HISTORY_PAGE_SIZE
+      })
+      skipScroll.current = true
+      setMessages(prev => [
+        ...historyData.messages.map(m => ({
+          role: m.role,
+          content: String(m.content || '')
+        })),
+        ...prev
+      ])
+      setNextBeforeId(historyData.has_more ? historyData.next_before_id : null)
+    } catch (err) {
+      setError('加载失败: ' + err.message)
+    } finally {
+      setLoadingMore(false)
+    }
+  }
+
   // 移动端键盘
   useEffect(() => {
     const handleResize = () => {
@@ -159,12 +218,13 @@ export default function Chat() {
           updated[updated.length - 1] = { role: 'assistant', content: safeText }
           return updated
         })
-      })
+      }, setQueuePosition)
     } catch (err) {
       setError(err.message || '发送失败')
       setMessages(prev => prev.slice(0, -1))
     } finally {
       setLoading(false)
+      setQueuePosition(null)
     }
   }
 
@@ -180,11 +240,34 @@ export default function Chat() {
     try {
       await agents.clearHistory(agentId)
       setMessages([])
+      setNextBeforeId(null)
     } catch (err) {
       setError('清空失败: ' + err.message)
     }
   }
 
+  const runSearch = async (offset = 0) => {
+    const q = searchQuery.trim()
+    if (!q || searching) return
+    setSearching(true)
+    try {
+      const data = await agents.searchHistory(q, { agentId, offset })
+      setSearchResults(prev => (offset && prev ? [...prev, ...data.results] : data.results))
+      setSearchNextOffset(data.has_more ? data.next_offset : null)
+    } catch (err) {
+      setError('搜索失败: ' + err.message)
+    } finally {
+      setSearching(false)
+    }
+  }
+
+  const closeSearch = () => {
+    setShowSearch(false)
+    setSearchQuery('')
+    setSearchResults(null)
+    setSearchNextOffset(null)
+  }
+
   if (!agent) {
     return (
       <div className="min-h-screen bg-[#F5F5F7] flex items-center justify-center">
@@ -210,6 +293,18 @@ export default function Chat() {
             <span className="text-lg sm:text-xl">{agent.icon}</span>
             <span className="font-medium text-[#1D1D1F] truncate text-sm sm:text-base">{agent.name}</span>
           </div>
+          {messages.length > 0 && (
+            <button
+              onClick={() => (showSearch ? closeSearch() : setShowSearch(true))}
+              className="w-10 h-10 sm:w-auto sm:h-auto sm:px-3 sm:py-1.5 flex items-center justify-center text-[#AEAEB2] hover:text-[#86868B] sm:hover:bg-[#F5F5F7] rounded-lg transition-colors text-sm"
+              title="搜索对话"
+            >
+              <svg className="w-5 h-5 sm:hidden" fill="none" stroke="currentColor" viewBox="0 0 24 24">
+                <path strokeLinecap="round" strokeLinejoin="round" strokeWidth={2} d="M21 21l-4.35-4.35M10.5 18a7.5 7.5 0 100-15 7.5 7.5 0 000 15z" />
+              </svg>
+              <span className="hidden sm:inline">{showSearch ? '关闭搜索' : '搜索'}</span>
+            </button>
+          )}
           {messages.length > 0 && (
             <button
               onClick={handleClearHistory}
@@ -225,98 +320,171 @@ export default function Chat() {
         </div>
       </header>
 
-      <div className="flex-1 overflow-y-auto">
-        <div className="max-w-3xl mx-auto px-4 sm:px-6 py-4 sm:py-8 space-y-4 sm:space-y-6">
-          {messages.length === 0 && (
-            <div className="text-center py-8 sm:py-12 px-4">
-              <div className="text-4xl sm:text-5xl mb-3 sm:mb-4">{agent.icon}</div>
-              <h2 className="text-lg sm:text-xl font-semibold text-[#1D1D1F] mb-2">
-                我是{agent.name}
-              </h2>
-              <p className="text-[#86868B] text-sm sm:text-base mb-6">{agent.description || '有什么可以帮助你的？'}</p>
-
-              {/* 快捷提问按钮 */}
-              {(() => {
-                // 解析quick_prompts，处理JSON解析错误
-                let prompts = []
-                try {
-                  prompts = JSON.parse(agent.quick_prompts || '[]')
-                  if (!Array.isArray(prompts)) prompts = []
-                } catch {
-                  prompts = []
-                }
-                // 如果没有配置，使用默认提问
-                if (prompts.length === 0) {
-                  prompts = ['你能帮我做什么？', '给我举个使用案例']
-                }
-                return (
-                  <div className="space-y-2 max-w-sm mx-auto">
-                    <p className="text-sm text-[#86868B] mb-3">试试这样问我：</p>
-                    {prompts.map((prompt, idx) => (
-                      <button
-                        key={idx}
-                        onClick={() => {
-                          setInput(prompt)
-                          setTimeout(() => {
-                            const btn = document.querySelector('[data-send-btn]')
-                            btn?.click()
-                          }, 100)
-                        }}
-                        className="w-full text-left px-4 py-3 bg-white border border-[#E5E5E7] rounded-xl text-sm text-[#1D1D1F] hover:bg-[#F5F5F7] hover:border-[#0066CC]/30 transition-colors"
-                      >
-                        "{prompt}"
-                      </button>
-                    ))}
-                  </div>
-                )
-              })()}
-            </div>
-          )}
-
-          {messages.map((msg, idx) => (
-            <div
-              key={idx}
-              className={`flex ${msg.role === 'user' ? 'justify-end' : 'justify-start'}`}
+      {showSearch && (
+        <div className="bg-white border-b border-[#E5E5E7] px-4 sm:px-6 py-2 flex-shrink-0">
+          <form
+            onSubmit={(e) => { e.preventDefault(); runSearch() }}
+            className="max-w-3xl mx-auto flex gap-2"
+          >
+            <input
+              type="text"
+              autoFocus
+              value={searchQuery}
+              onChange={(e) => setSearchQuery(e.target.value)}
+              placeholder="搜索对话记录，多个关键词用空格分隔"
+              maxLength={100}
+              className="flex-1 px-3 py-2 bg-[#F5F5F7] border border-[#E5E5E7] rounded-lg text-sm text-[#1D1D1F] placeholder-[#AEAEB2] focus:outline-none focus:ring-2 focus:ring-[#0066CC] focus:border-transparent"
+            />
+            <button
+              type="submit"
+              disabled={searching || !searchQuery.trim()}
+              className="px-4 py-2 bg-[#0066CC] hover:bg-[#0055AA] disabled:bg-[#E5E5E7] disabled:text-[#AEAEB2] text-white text-sm font-medium rounded-lg transition-colors"
             >
+              搜索
+            </button>
+          </form>
+        </div>
+      )}
+
+      {showSearch && searchResults !== null ? (
+        <div className="flex-1 overflow-y-auto">
+          <div className="max-w-3xl mx-auto px-4 sm:px-6 py-4 space-y-3">
+            {searchResults.length === 0 && (
+              <div className="text-center text-[#AEAEB2] text-sm py-8">没有找到相关对话</div>
+            )}
+            {searchResults.map(hit => (
+              <div key={hit.id} className="bg-white border border-[#E5E5E7] rounded-xl px-4 py-3">
+                <div className="flex items-center justify-between mb-1 text-xs text-[#AEAEB2]">
+                  <span>{hit.role === 'user' ? '我' : agent.name}</span>
+                  <span>{new Date(hit.created_at).toLocaleString()}</span>
+                </div>
+                <div className="text-sm text-[#1D1D1F] leading-relaxed">
+                  <HighlightedSnippet text={hit.snippet} highlights={hit.highlights} />
+                </div>
+              </div>
+            ))}
+            {searchNextOffset !== null && (
+              <div className="text-center">
+                <button
+                  onClick={() => runSearch(searchNextOffset)}
+                  disabled={searching}
+                  className="text-sm text-[#0066CC] hover:text-[#0055AA] disabled:text-[#AEAEB2] transition-colors"
+                >
+                  {searching ? '加载中...' : '加载更多结果'}
+                </button>
+              </div>
+            )}
+            {error && (
+              <div className="text-center text-red-500 text-sm py-2">{error}</div>
+            )}
+          </div>
+        </div>
+      ) : (
+        <div className="flex-1 overflow-y-auto">
+          <div className="max-w-3xl mx-auto px-4 sm:px-6 py-4 sm:py-8 space-y-4 sm:space-y-6">
+            {messages.length === 0 && (
+              <div className="text-center py-8 sm:py-12 px-4">
+                <div className="text-4xl sm:text-5xl mb-3 sm:mb-4">{agent.icon}</div>
+                <h2 className="text-lg sm:text-xl font-semibold text-[#1D1D1F] mb-2">
+                  我是{agent.name}
+                </h2>
+                <p className="text-[#86868B] text-sm sm:text-base mb-6">{agent.description || '有什么可以帮助你的？'}</p>
+
+                {/* 快捷提问按钮 */}
+                {(() => {
+                  // 解析quick_prompts，处理JSON解析错误
+                  let prompts = []
+                  try {
+                    prompts = JSON.parse(agent.quick_prompts || '[]')
+                    if (!Array.isArray(prompts)) prompts = []
+                  } catch {
+                    prompts = []
+                  }
+                  // 如果没有配置，使用默认提问
+                  if (prompts.length === 0) {
+                    prompts = ['你能帮我做什么？', '给我举个使用案例']
+                  }
+                  return (
+                    <div className="space-y-2 max-w-sm mx-auto">
+                      <p className="text-sm text-[#86868B] mb-3">试试这样问我：</p>
+                      {prompts.map((prompt, idx) => (
+                        <button
+                          key={idx}
+                          onClick={() => {
+                            setInput(prompt)
+                            setTimeout(() => {
+                              const btn = document.querySelector('[data-send-btn]')
+                              btn?.click()
+                            }, 100)
+                          }}
+                          className="w-full text-left px-4 py-3 bg-white border border-[#E5E5E7] rounded-xl text-sm text-[#1D1D1F] hover:bg-[#F5F5F7] hover:border-[#0066CC]/30 transition-colors"
+                        >
+                          "{prompt}"
+                        </button>
+                      ))}
+                    </div>
+                  )
+                })()}
+              </div>
+            )}
+
+            {nextBeforeId && (
+              <div className="text-center">
+                <button
+                  onClick={handleLoadMore}
+                  disabled={loadingMore}
+                  className="text-sm text-[#0066CC] hover:text-[#0055AA] disabled:text-[#AEAEB2] transition-colors"
+                >
+                  {loadingMore ? '加载中...' : '加载更早的消息'}
+                </button>
+              </div>
+            )}
+
+            {messages.map((msg, idx) => (
               <div
-                className={`max-w-[85%] sm:max-w-[80%] rounded-2xl px-4 py-3 ${
-                  msg.role === 'user'
-                    ? 'bg-[#0066CC] text-white'
-                    : 'bg-white border border-[#E5E5E7] text-[#1D1D1F]'
-                }`}
+                key={idx}
+                className={`flex ${msg.role === 'user' ? 'justify-end' : 'justify-start'}`}
               >
-                {msg.role === 'assistant' && (
-                  <div className="flex items-center gap-2 mb-2 text-xs text-[#AEAEB2]">
-                    <span>{agent.icon}</span>
-                    <span>{agent.name}</span>
-                  </div>
-                )}
-                <div className="leading-relaxed text-[15px] sm:text-base">
-                  {msg.role === 'assistant' ? (
-                    msg.content ? (
-                      <SafeMarkdown content={msg.content} />
-                    ) : (
-                      loading && idx === messages.length - 1 ? (
-                        <ThinkingIndicator />
-                      ) : null
-                    )
-                  ) : (
-                    <span className="whitespace-pre-wrap">{msg.content}</span>
+                <div
+                  className={`max-w-[85%] sm:max-w-[80%] rounded-2xl px-4 py-3 ${
+                    msg.role === 'user'
+                      ? 'bg-[#0066CC] text-white'
+                      : 'bg-white border border-[#E5E5E7] text-[#1D1D1F]'
+                  }`}
+                >
+                  {msg.role === 'assistant' && (
+                    <div className="flex items-center gap-2 mb-2 text-xs text-[#AEAEB2]">
+                      <span>{agent.icon}</span>
+                      <span>{agent.name}</span>
+                    </div>
                   )}
+                  <div className="leading-relaxed text-[15px] sm:text-base">
+                    {msg.role === 'assistant' ? (
+                      msg.content ? (
+                        <SafeMarkdown content={msg.content} />
+                      ) : (
+                        loading && idx === messages.length - 1 ? (
+                          <ThinkingIndicator queuePosition={queuePosition} />
+                        ) : null
+                      )
+                    ) : (
+                      <span className="whitespace-pre-wrap">{msg.content}</span>
+                    )}
+                  </div>
                 </div>
               </div>
-            </div>
-          ))}
+            ))}
 
-          {error && (
-            <div className="text-center text-red-500 text-sm py-2">
-              {error}
-            </div>
-          )}
+            {error && (
+              <div className="text-center text-red-500 text-sm py-2">
+                {error}
+              </div>
+            )}
 
-          <div ref={messagesEndRef} />
+            <div ref={messagesEndRef} />
+          </div>
         </div>
-      </div>
+      )}
 
       <div className="bg-white border-t border-[#E5E5E7] px-4 sm:px-6 py-3 sm:py-4 flex-shrink-0 safe-area-bottom">
         <div className="max-w-3xl mx-auto flex gap-2 sm:gap-3">
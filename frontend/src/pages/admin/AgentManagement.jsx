@@ -9,10 +9,23 @@ const defaultForm = {
   api_endpoint: '',
   api_token: '',
   project_id: '',
+  rate_limit: '',
+  rate_burst: '',
+  max_in_flight: '',
+  queue_depth: '',
   tier_required: '365',
   status: 'active',
   sort_order: 0,
-  quick_prompts: []
+  quick_prompts: [],
+  answer_cache: false,
+  stateless: false
+}
+
+// 上游熔断状态
+const circuitLabels = {
+  closed: '正常',
+  open: '熔断中',
+  half_open: '探测中'
 }
 
 // 解析JSON字符串为数组
@@ -64,10 +77,16 @@ export default function AgentManagement() {
       api_endpoint: agent.api_endpoint,
       api_token: agent.api_token,
       project_id: agent.project_id,
+      rate_limit: agent.rate_limit ?? '',
+      rate_burst: agent.rate_burst ?? '',
+      max_in_flight: agent.max_in_flight ?? '',
+      queue_depth: agent.queue_depth ?? '',
       tier_required: agent.tier_required,
       status: agent.status,
       sort_order: agent.sort_order,
-      quick_prompts: parseQuickPrompts(agent.quick_prompts)
+      quick_prompts: parseQuickPrompts(agent.quick_prompts),
+      answer_cache: !!agent.answer_cache,
+      stateless: !!agent.stateless
     })
     setShowModal(true)
   }
@@ -78,7 +97,12 @@ export default function AgentManagement() {
       // 将quick_prompts数组转换为JSON字符串
       const dataToSave = {
         ...form,
-        quick_prompts: JSON.stringify(form.quick_prompts || [])
+        quick_prompts: JSON.stringify(form.quick_prompts || []),
+        // 留空表示使用默认限流和并发配置
+        rate_limit: form.rate_limit === '' ? null : parseFloat(form.rate_limit),
+        rate_burst: form.rate_burst === '' ? null : parseInt(form.rate_burst),
+        max_in_flight: form.max_in_flight === '' ? null : parseInt(form.max_in_flight),
+        queue_depth: form.queue_depth === '' ? null : parseInt(form.queue_depth)
       }
       if (editingId) {
         await admin.agents.update(editingId, dataToSave)
@@ -124,6 +148,16 @@ export default function AgentManagement() {
     }
   }
 
+  const handlePurgeCache = async (id) => {
+    if (!confirm('确定清除此智能体的快捷提问缓存？')) return
+    try {
+      const res = await admin.agents.purgeAnswerCache(id)
+      alert(res.message)
+    } catch (err) {
+      alert(err.message)
+    }
+  }
+
   return (
     <div>
       <div className="flex items-center justify-between mb-8">
@@ -147,6 +181,7 @@ export default function AgentManagement() {
                 <th className="px-6 py-4 text-left text-xs font-medium text-[#86868B] uppercase tracking-wider">分类</th>
                 <th className="px-6 py-4 text-left text-xs font-medium text-[#86868B] uppercase tracking-wider">等级要求</th>
                 <th className="px-6 py-4 text-left text-xs font-medium text-[#86868B] uppercase tracking-wider">状态</th>
+                <th className="px-6 py-4 text-left text-xs font-medium text-[#86868B] uppercase tracking-wider">上游</th>
                 <th className="px-6 py-4 text-left text-xs font-medium text-[#86868B] uppercase tracking-wider">排序</th>
                 <th className="px-6 py-4 text-right text-xs font-medium text-[#86868B] uppercase tracking-wider">操作</th>
               </tr>
@@ -175,6 +210,17 @@ export default function AgentManagement() {
                       {agent.status === 'active' ? '启用' : '即将上线'}
                     </span>
                   </td>
+                  <td className="px-6 py-4">
+                    <span className={`inline-flex px-2 py-1 text-xs font-medium rounded ${
+                      agent.circuit_state === 'open'
+                        ? 'bg-red-50 text-red-700'
+                        : agent.circuit_state === 'half_open'
+                          ? 'bg-amber-50 text-amber-700'
+                          : 'bg-green-50 text-green-700'
+                    }`}>
+                      {circuitLabels[agent.circuit_state] || '正常'}
+                    </span>
+                  </td>
                   <td className="px-6 py-4 text-[#86868B] text-sm">{agent.sort_order}</td>
                   <td className="px-6 py-4 text-right">
                     <button
@@ -183,6 +229,14 @@ export default function AgentManagement() {
                     >
                       编辑
                     </button>
+                    {agent.answer_cache && (
+                      <button
+                        onClick={() => handlePurgeCache(agent.id)}
+                        className="text-[#0066CC] hover:text-[#0055AA] text-sm mr-4"
+                      >
+                        清除缓存
+                      </button>
+                    )}
                     <button
                       onClick={() => handleDelete(agent.id)}
                       className="text-red-500 hover:text-red-600 text-sm"
@@ -194,7 +248,7 @@ export default function AgentManagement() {
               ))}
               {agents.length === 0 && (
                 <tr>
-                  <td colSpan="6" className="px-6 py-12 text-center text-[#AEAEB2]">
+                  <td colSpan="7" className="px-6 py-12 text-center text-[#AEAEB2]">
                     暂无智能体
                   </td>
                 </tr>
@@ -312,6 +366,76 @@ export default function AgentManagement() {
                   <option value="coming_soon">即将上线</option>
                 </select>
               </div>
+              <div>
+                <label className="block text-sm font-medium text-[#1D1D1F] mb-2">限流（次/秒）</label>
+                <input
+                  type="number"
+                  min="0"
+                  step="0.1"
+                  value={form.rate_limit}
+                  onChange={(e) => setForm({ ...form, rate_limit: e.target.value })}
+                  className="w-full px-3 py-2 border border-[#E5E5E7] rounded-lg text-[#1D1D1F] focus:outline-none focus:ring-2 focus:ring-[#0066CC]"
+                  placeholder="默认"
+                />
+              </div>
+              <div>
+                <label className="block text-sm font-medium text-[#1D1D1F] mb-2">突发容量</label>
+                <input
+                  type="number"
+                  min="1"
+                  value={form.rate_burst}
+                  onChange={(e) => setForm({ ...form, rate_burst: e.target.value })}
+                  className="w-full px-3 py-2 border border-[#E5E5E7] rounded-lg text-[#1D1D1F] focus:outline-none focus:ring-2 focus:ring-[#0066CC]"
+                  placeholder="默认"
+                />
+              </div>
+              <div>
+                <label className="block text-sm font-medium text-[#1D1D1F] mb-2">最大并发</label>
+                <input
+                  type="number"
+                  min="1"
+                  value={form.max_in_flight}
+                  onChange={(e) => setForm({ ...form, max_in_flight: e.target.value })}
+                  className="w-full px-3 py-2 border border-[#E5E5E7] rounded-lg text-[#1D1D1F] focus:outline-none focus:ring-2 focus:ring-[#0066CC]"
+                  placeholder="默认"
+                />
+              </div>
+              <div>
+                <label className="block text-sm font-medium text-[#1D1D1F] mb-2">排队上限</label>
+                <input
+                  type="number"
+                  min="0"
+                  value={form.queue_depth}
+                  onChange={(e) => setForm({ ...form, queue_depth: e.target.value })}
+                  className="w-full px-3 py-2 border border-[#E5E5E7] rounded-lg text-[#1D1D1F] focus:outline-none focus:ring-2 focus:ring-[#0066CC]"
+                  placeholder="默认"
+                />
+              </div>
+
+              <div className="col-span-2">
+                <label className="flex items-center gap-2 text-sm font-medium text-[#1D1D1F]">
+                  <input
+                    type="checkbox"
+                    checked={form.answer_cache}
+                    onChange={(e) => setForm({ ...form, answer_cache: e.target.checked })}
+                    className="rounded border-[#E5E5E7]"
+                  />
+                  缓存快捷提问回答
+                </label>
+                <p className="text-xs text-[#86868B] mt-1">开启后，快捷提问的回答会被缓存，再次点击时直接回放，不调用上游</p>
+              </div>
+              <div className="col-span-2">
+                <label className="flex items-center gap-2 text-sm font-medium text-[#1D1D1F]">
+                  <input
+                    type="checkbox"
+                    checked={form.stateless}
+                    onChange={(e) => setForm({ ...form, stateless: e.target.checked })}
+                    className="rounded border-[#E5E5E7]"
+                  />
+                  无状态智能体
+                </label>
+                <p className="text-xs text-[#86868B] mt-1">回答不依赖对话上下文时开启，多个用户同时提出相同问题只调用一次上游</p>
+              </div>
 
               {/* 快捷提问编辑 */}
               <div className="col-span-2">
@@ -58,6 +58,14 @@ export default function FeedbackManagement() {
 
   const pendingCount = feedbacks.filter(f => f.status === 'pending').length
 
+  const handleExport = async (dataset) => {
+    try {
+      await admin.exportData(dataset)
+    } catch (err) {
+      alert(err.message)
+    }
+  }
+
   return (
     <div>
       <div className="flex items-center justify-between mb-8">
@@ -72,6 +80,12 @@ export default function FeedbackManagement() {
 
         {/* 筛选器 */}
         <div className="flex gap-2">
+          <button
+            onClick={() => handleExport('feedbacks')}
+            className="px-3 py-1.5 rounded-lg text-sm font-medium bg-[#F5F5F7] text-[#1D1D1F] hover:bg-[#E5E5E7] transition-colors"
+          >
+            导出
+          </button>
           {[
             { key: '', label: '全部' },
             { key: 'pending', label: '待处理' },
@@ -65,10 +65,32 @@ export default function UserManagement() {
     }
   }
 
+  const handleExport = async (dataset) => {
+    try {
+      await admin.exportData(dataset)
+    } catch (err) {
+      alert(err.message)
+    }
+  }
+
   return (
     <div>
       <div className="flex items-center justify-between mb-8">
         <h1 className="text-2xl font-semibold text-[#1D1D1F]">用户管理</h1>
+        <div className="flex gap-2">
+          <button
+            onClick={() => handleExport('users')}
+            className="px-4 py-2 bg-[#F5F5F7] hover:bg-[#E5E5E7] text-[#1D1D1F] text-sm font-medium rounded-lg transition-colors"
+          >
+            导出用户
+          </button>
+          <button
+            onClick={() => handleExport('messages')}
+            className="px-4 py-2 bg-[#F5F5F7] hover:bg-[#E5E5E7] text-[#1D1D1F] text-sm font-medium rounded-lg transition-colors"
+          >
+            导出对话记录
+          </button>
+        </div>
       </div>
 
       {loading ? (
@@ -30,6 +30,20 @@ async function request(path, options = {}) {
   return res.json()
 }
 
+// 下载需要认证的文件（导出数据等）
+// 先换取短期下载凭证，再由浏览器直接请求链接：响应边下载边写入磁盘，不在页面内存中缓冲
+async function download(path) {
+  const { token } = await request("/admin/download-token", { method: "POST" })
+  const separator = path.includes("?") ? "&" : "?"
+  const link = document.createElement("a")
+  link.href = `${API_BASE}${path}${separator}token=${encodeURIComponent(token)}`
+  // 文件名取自服务端的 Content-Disposition
+  link.download = ""
+  document.body.appendChild(link)
+  link.click()
+  link.remove()
+}
+
 // 认证
 export const auth = {
   login: (phone, password) =>
@@ -49,63 +63,121 @@ export const auth = {
 export const agents = {
   list: () => request("/agents"),
   get: (id) => request(`/agents/${id}`),
-  getHistory: (id) => request(`/agents/${id}/history`),
-  clearHistory: (id) => request(`/agents/${id}/history`, { method: "DELETE" })
+  // 不传 beforeId 返回最新的 limit 条；加载更早消息时传入上一页的 next_before_id
+  getHistory: (id, { beforeId, limit } = {}) => {
+    const params = new URLSearchParams()
+    if (beforeId) params.set("before_id", beforeId)
+    if (limit) params.set("limit", limit)
+    const query = params.toString()
+    return request(`/agents/${id}/history${query ? `?${query}` : ""}`)
+  },
+  clearHistory: (id) => request(`/agents/${id}/history`, { method: "DELETE" }),
+  // 检索自己的对话记录；不传 agentId 时检索全部智能体，翻页时传入上一页的 next_offset
+  searchHistory: (q, { agentId, offset, limit } = {}) => {
+    const params = new URLSearchParams({ q })
+    if (agentId) params.set("agent_id", agentId)
+    if (offset) params.set("offset", offset)
+    if (limit) params.set("limit", limit)
+    return request(`/agents/search?${params.toString()}`)
+  }
 }
 
 // SSE对话
-export async function chatWithAgent(agentId, message, onChunk) {
-  const token = getToken()
+// 连接中断时携带同一个幂等键和 Last-Event-ID 重连，从断点续传，不会重复调用智能体
+const CHAT_RESUME_ATTEMPTS = 3
 
-  const res = await fetch(`${API_BASE}/agents/${agentId}/chat`, {
-    method: "POST",
-    headers: {
-      "Authorization": `Bearer ${token}`,
-      "Content-Type": "application/json"
-    },
-    body: JSON.stringify({ message })
-  })
+function newIdempotencyKey() {
+  if (window.crypto?.randomUUID) return window.crypto.randomUUID()
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+}
 
-  if (!res.ok) {
-    const error = await res.json().catch(() => ({ detail: "请求失败" }))
-    throw new Error(error.detail || "请求失败")
-  }
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms))
 
-  const reader = res.body.getReader()
-  const decoder = new TextDecoder()
+export async function chatWithAgent(agentId, message, onChunk, onQueue) {
+  const token = getToken()
+  const idempotencyKey = newIdempotencyKey()
   let fullText = ""
+  let lastEventId = null
 
-  while (true) {
-    const { done, value } = await reader.read()
-    if (done) break
-
-    const chunk = decoder.decode(value)
-    const lines = chunk.split("\n")
-
-    for (const line of lines) {
-      if (line.startsWith("data: ")) {
-        const data = line.slice(6)
-        if (data === "[DONE]") return fullText
+  for (let attempt = 0; ; attempt++) {
+    const headers = {
+      "Authorization": `Bearer ${token}`,
+      "Content-Type": "application/json"
+    }
+    if (lastEventId !== null) {
+      headers["Last-Event-ID"] = String(lastEventId)
+    }
 
-        try {
-          const parsed = JSON.parse(data)
-          if (parsed.content) {
-            fullText += parsed.content
-            onChunk(fullText)
-          }
-          if (parsed.error) {
-            throw new Error(parsed.error)
-          }
-        } catch (e) {
-          if (e.message && !e.message.includes("JSON")) {
-            throw e
+    let res = null
+    let serverError = null
+    try {
+      res = await fetch(`${API_BASE}/agents/${agentId}/chat`, {
+        method: "POST",
+        headers,
+        body: JSON.stringify({ message, idempotency_key: idempotencyKey })
+      })
+
+      if (!res.ok) {
+        // 续传时回答已结束并过期，已收到的内容保留，完整回答在对话记录中
+        if (res.status === 410 && fullText) return fullText
+        const error = await res.json().catch(() => ({ detail: "请求失败" }))
+        serverError = new Error(error.detail || "请求失败")
+      } else {
+        const reader = res.body.getReader()
+        const decoder = new TextDecoder()
+        let buffer = ""
+
+        while (!serverError) {
+          const { done, value } = await reader.read()
+          if (done) break
+
+          // 一帧可能被拆在多次读取中，保留最后一个不完整的行等待后续数据
+          buffer += decoder.decode(value, { stream: true })
+          const lines = buffer.split("\n")
+          buffer = lines.pop()
+
+          for (const line of lines) {
+            if (line.startsWith("id: ")) {
+              lastEventId = parseInt(line.slice(4), 10)
+              continue
+            }
+            if (!line.startsWith("data: ")) continue
+            const data = line.slice(6)
+            if (data === "[DONE]") return fullText
+
+            let parsed
+            try {
+              parsed = JSON.parse(data)
+            } catch {
+              continue
+            }
+            // 排队中：通知当前排队位置
+            if (parsed.queue) {
+              onQueue?.(parsed.queue.position)
+            }
+            if (parsed.content) {
+              fullText += parsed.content
+              onChunk(fullText)
+            }
+            if (parsed.error) {
+              serverError = new Error(parsed.error)
+              break
+            }
           }
         }
       }
+    } catch (e) {
+      // 网络中断：稍后重连续传
+      if (attempt >= CHAT_RESUME_ATTEMPTS) throw e
     }
-  }
 
-  return fullText
+    if (serverError) throw serverError
+    if (attempt >= CHAT_RESUME_ATTEMPTS) {
+      if (fullText) return fullText
+      throw new Error("连接中断，请重试")
+    }
+    await sleep(1000 * (attempt + 1))
+  }
 }
 
 // 用户统计
@@ -124,7 +196,8 @@ export const admin = {
     list: () => request("/admin/agents"),
     create: (data) => request("/admin/agents", { method: "POST", body: JSON.stringify(data) }),
     update: (id, data) => request(`/admin/agents/${id}`, { method: "PUT", body: JSON.stringify(data) }),
-    delete: (id) => request(`/admin/agents/${id}`, { method: "DELETE" })
+    delete: (id) => request(`/admin/agents/${id}`, { method: "DELETE" }),
+    purgeAnswerCache: (id) => request(`/admin/agents/${id}/answer-cache`, { method: "DELETE" })
   },
   users: {
     list: () => request("/admin/users"),
@@ -133,5 +206,12 @@ export const admin = {
   feedbacks: {
     list: (status) => request(`/admin/feedbacks${status ? `?status=${status}` : ''}`),
     updateStatus: (id, status) => request(`/admin/feedbacks/${id}`, { method: "PUT", body: JSON.stringify({ status }) })
+  },
+  // 导出 users / feedbacks / messages；默认下载 gzip 压缩的 CSV（.csv.gz），compress: false 时下载未压缩文件
+  exportData: (dataset, { format = "csv", startDate, endDate, compress = true } = {}) => {
+    const params = new URLSearchParams({ format, compress })
+    if (startDate) params.set("start_date", startDate)
+    if (endDate) params.set("end_date", endDate)
+    return download(`/admin/export/${dataset}?${params.toString()}`)
   }
 }